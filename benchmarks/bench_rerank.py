@@ -0,0 +1,46 @@
+"""
+Microbenchmark for MMR re-ranking and token-budget packing.
+
+Loads src/rerank.py directly so it runs without Qdrant, Ollama or API keys:
+
+    python benchmarks/bench_rerank.py --candidates 100 300 1000 --dims 1024
+"""
+import argparse
+import os
+import sys
+import timeit
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+from rerank import mmr_rerank, pack_by_token_budget  # noqa: E402
+
+
+def bench(label, func, repeat):
+    runs = timeit.repeat(func, number=1, repeat=repeat)
+    runs.sort()
+    median = runs[len(runs) // 2] * 1000
+    p95 = runs[int(len(runs) * 0.95) - 1] * 1000
+    print(f"{label:<40} median {median:8.3f} ms   p95 {p95:8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MMR re-ranking microbenchmark")
+    parser.add_argument("--candidates", type=int, nargs="+", default=[100, 300, 1000])
+    parser.add_argument("--dims", type=int, default=1024)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    query = rng.standard_normal(args.dims).astype(np.float32)
+    for n in args.candidates:
+        vectors = rng.standard_normal((n, args.dims)).astype(np.float32)
+        bench(f"mmr_rerank n={n} d={args.dims} k={args.k}",
+              lambda: mmr_rerank(query, vectors, args.k), args.repeat)
+
+    texts = [f"- memory number {i} about a topic the user mentioned earlier" for i in range(args.k)]
+    bench(f"pack_by_token_budget {args.k} texts", lambda: pack_by_token_budget(texts, 800), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+Retrieval tuning harness: recall@k against p95 latency on a local Qdrant.
+
+Builds a synthetic collection (or replays queries sampled from an existing one) and
+sweeps candidate limit, hnsw_ef, exact vs. approximate search, quantization
+rescoring and the hybrid fusion weight. Runs without Ollama or API keys:
+
+    python benchmarks/tune_retrieval.py --points 20000 --dims 1024 --quantize
+    python benchmarks/tune_retrieval.py --collection memory_orb_alice --queries 200
+
+Ground truth for recall@k is an exact (brute-force) search with the same query. The
+fusion sweep measures how often the point a query was derived from lands in the top k
+of hybrid_merge. Use --output to save all rows, and put the chosen values in
+ORB_SEARCH_PARAMS, e.g. '{"chat": {"limit": 30, "hnsw_ef": 64}}'.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from uuid import uuid4
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+from rerank import hybrid_merge  # noqa: E402
+
+WORDS = ("wallet gas staking validator bridge rollup token swap liquidity oracle nft dao airdrop "
+         "ledger mempool slashing blob calldata sequencer restaking").split()
+
+
+def create_synthetic(client, name, points, dims, clusters, quantize, rng):
+    """Clustered random vectors with short keyword texts, so ANN and keyword search are both non-trivial"""
+    client.create_collection(
+        collection_name=name,
+        vectors_config=models.VectorParams(size=dims, distance=models.Distance.COSINE),
+        quantization_config=models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, always_ram=True)
+        ) if quantize else None,
+    )
+    client.create_payload_index(name, "conversation", models.TextIndexParams(
+        type="text", tokenizer=models.TokenizerType.WORD, lowercase=True))
+
+    centers = rng.standard_normal((clusters, dims)).astype(np.float32)
+    for start in range(0, points, 1000):
+        count = min(1000, points - start)
+        labels = rng.integers(0, clusters, count)
+        vectors = centers[labels] + 0.6 * rng.standard_normal((count, dims)).astype(np.float32)
+        client.upsert(name, points=[
+            models.PointStruct(id=start + i, vector=vectors[i].tolist(),
+                               payload={"conversation": " ".join(rng.choice(WORDS, 4))})
+            for i in range(count)
+        ], wait=True)
+
+
+def sample_queries(client, name, count, noise, text_field, rng):
+    """Queries derived from stored points: (target id, perturbed vector, keyword text)"""
+    total = client.count(name, exact=True).count
+    points, offset = [], None
+    while len(points) < min(total, count * 20):
+        batch, offset = client.scroll(name, limit=1000, offset=offset, with_payload=True, with_vectors=True)
+        points.extend(p for p in batch if isinstance(p.vector, list))
+        if offset is None:
+            break
+    chosen = rng.choice(len(points), size=min(count, len(points)), replace=False)
+    queries = []
+    for i in chosen:
+        vector = np.asarray(points[i].vector, dtype=np.float32)
+        vector = vector + noise * np.linalg.norm(vector) / np.sqrt(len(vector)) * rng.standard_normal(len(vector))
+        text = (points[i].payload or {}).get(text_field) or ""
+        queries.append((points[i].id, vector.tolist(), " ".join(text.split()[:2])))
+    return queries
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q) * 1000) if values else 0.0
+
+
+def run_vector(client, name, queries, truth, k, limit, search_params):
+    latencies, recalls = [], []
+    for (_, vector, _), expected in zip(queries, truth):
+        started = time.perf_counter()
+        hits = client.search(name, query_vector=vector, limit=limit, search_params=search_params)
+        latencies.append(time.perf_counter() - started)
+        found = {hit.id for hit in hits[:k]}
+        recalls.append(len(found & expected) / max(len(expected), 1))
+    return float(np.mean(recalls)), percentile(latencies, 50), percentile(latencies, 95)
+
+
+def run_hybrid(client, name, queries, k, limit, alpha, text_field):
+    latencies, hits_at_k = [], []
+    for target, vector, text in queries:
+        started = time.perf_counter()
+        vector_results = client.search(name, query_vector=vector, limit=limit)
+        keyword_results, _ = client.scroll(name, limit=limit, scroll_filter=models.Filter(
+            must=[models.FieldCondition(key=text_field, match=models.MatchText(text=text))]))
+        merged = hybrid_merge(vector_results, keyword_results, alpha)
+        latencies.append(time.perf_counter() - started)
+        hits_at_k.append(any(item.id == target for item in merged[:k]))
+    return float(np.mean(hits_at_k)), percentile(latencies, 50), percentile(latencies, 95)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep Qdrant search parameters, report recall@k and latency")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=6333)
+    parser.add_argument("--collection", help="Replay queries against this existing collection instead of a synthetic one")
+    parser.add_argument("--points", type=int, default=20000, help="Synthetic collection size")
+    parser.add_argument("--dims", type=int, default=1024)
+    parser.add_argument("--clusters", type=int, default=50)
+    parser.add_argument("--quantize", action="store_true", help="Enable int8 scalar quantization on the synthetic collection")
+    parser.add_argument("--keep", action="store_true", help="Keep the synthetic collection afterwards")
+    parser.add_argument("--text-field", default="conversation", help="Payload field for the keyword leg (\"data\" for mem0 memories)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.3, help="Relative noise added to sampled query vectors")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--limits", type=int, nargs="+", default=[3, 5, 10, 20, 50])
+    parser.add_argument("--hnsw-ef", type=int, nargs="+", default=[0, 32, 64, 128, 256], help="0 = collection default")
+    parser.add_argument("--alphas", type=float, nargs="+", default=[0.0, 0.25, 0.5, 0.75, 1.0])
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    parser.add_argument("--output", help="Write all result rows to this JSON file")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    client = QdrantClient(host=args.host, port=args.port, timeout=120)
+    name = args.collection or f"orb_tuning_{uuid4().hex[:8]}"
+    if not args.collection:
+        print(f"Building synthetic collection {name} ({args.points} x {args.dims})...")
+        create_synthetic(client, name, args.points, args.dims, args.clusters, args.quantize, rng)
+
+    try:
+        quantized = client.get_collection(name).config.quantization_config is not None
+        queries = sample_queries(client, name, args.queries, args.noise, args.text_field, rng)
+        exact = models.SearchParams(exact=True)
+        truth = [{hit.id for hit in client.search(name, query_vector=vector, limit=args.k, search_params=exact)}
+                 for _, vector, _ in queries]
+
+        rows = []
+        print(f"{'limit':>5} {'hnsw_ef':>7} {'exact':>5} {'rescore':>7} {'recall@k':>8} {'p50 ms':>8} {'p95 ms':>8}")
+        for limit in args.limits:
+            configs = [(ef or None, False, None) for ef in args.hnsw_ef] + [(None, True, None)]
+            if quantized:
+                configs += [(ef or None, False, rescore) for ef in args.hnsw_ef for rescore in (False, True)]
+            for hnsw_ef, is_exact, rescore in configs:
+                quantization = None if rescore is None else models.QuantizationSearchParams(rescore=rescore)
+                search_params = models.SearchParams(hnsw_ef=hnsw_ef, exact=is_exact, quantization=quantization)
+                recall, p50, p95 = run_vector(client, name, queries, truth, args.k, limit, search_params)
+                rows.append({"mode": "vector", "limit": limit, "hnsw_ef": hnsw_ef, "exact": is_exact,
+                             "rescore": rescore, "recall": recall, "p50_ms": p50, "p95_ms": p95})
+                print(f"{limit:>5} {hnsw_ef or '-':>7} {str(is_exact):>5} {str(rescore):>7} "
+                      f"{recall:>8.3f} {p50:>8.2f} {p95:>8.2f}")
+
+        print(f"\n{'limit':>5} {'alpha':>5} {'hit@k':>8} {'p50 ms':>8} {'p95 ms':>8}")
+        for limit in args.limits:
+            for alpha in args.alphas:
+                hit_rate, p50, p95 = run_hybrid(client, name, queries, args.k, limit, alpha, args.text_field)
+                rows.append({"mode": "hybrid", "limit": limit, "alpha": alpha,
+                             "recall": hit_rate, "p50_ms": p50, "p95_ms": p95})
+                print(f"{limit:>5} {alpha:>5.2f} {hit_rate:>8.3f} {p50:>8.2f} {p95:>8.2f}")
+
+        # 满足召回目标的配置中取 p95 最低者
+        for mode in ("vector", "hybrid"):
+            good = [row for row in rows if row["mode"] == mode and row["recall"] >= args.target_recall]
+            if good:
+                best = min(good, key=lambda row: row["p95_ms"])
+                keys = ("limit", "hnsw_ef", "exact", "rescore") if mode == "vector" else ("limit", "alpha")
+                params = {key: best[key] for key in keys if best[key] is not None}
+                print(f"\nFastest {mode} config with recall >= {args.target_recall}: {json.dumps(params)}")
+            else:
+                print(f"\nNo {mode} config reached recall {args.target_recall}")
+
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump({"collection": name, "k": args.k, "queries": len(queries), "rows": rows}, f, indent=2)
+    finally:
+        if not args.collection and not args.keep:
+            client.delete_collection(name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+import math
+import threading
+import time
+from collections import deque
+from functools import wraps
+from flask import request, jsonify, make_response, g
+from .config import (ADMISSION_MAX_CONCURRENT, ADMISSION_MAX_PER_USER, ADMISSION_MAX_QUEUE,
+                     ADMISSION_MAX_QUEUE_PER_USER, ADMISSION_QUEUE_TIMEOUT)
+from .metrics import ADMISSION_QUEUE_WAIT_SECONDS, ADMISSION_REJECTED, ADMISSION_ACTIVE, register_queue
+
+
+class Overloaded(Exception):
+    """Raised when a request cannot be admitted; retry_after is in seconds"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Server overloaded ({reason}), retry after {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """An admission slot; release() is idempotent"""
+
+    def __init__(self, controller, user_id):
+        self.controller = controller
+        self.user_id = user_id
+        self.admitted_at = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.controller._release(self)
+
+
+class _Waiter:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.event = threading.Event()
+        self.granted = False
+
+
+class AdmissionController:
+    """
+    Caps concurrent work globally and per user.
+
+    Requests over the cap wait in a bounded FIFO queue up to queue_timeout seconds;
+    when the queue is full or the deadline passes they are rejected with Overloaded.
+    """
+
+    def __init__(self, name, max_concurrent, max_per_user, max_queue, max_queue_per_user, queue_timeout):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.queue_timeout = queue_timeout
+
+        self._lock = threading.Lock()
+        self._active = 0
+        self._active_per_user = {}
+        self._waiters = deque()
+        self._waiting_per_user = {}
+        self._avg_hold = 1.0  # 请求占用时长的滑动平均，用于估算 Retry-After
+
+        register_queue(f"admission_{name}", lambda: len(self._waiters))
+
+    def _has_capacity(self, user_id):
+        return self._active < self.max_concurrent and self._active_per_user.get(user_id, 0) < self.max_per_user
+
+    def _grant(self, user_id):
+        self._active += 1
+        self._active_per_user[user_id] = self._active_per_user.get(user_id, 0) + 1
+        ADMISSION_ACTIVE.labels(self.name).inc()
+
+    def _retry_after(self):
+        backlog = len(self._waiters) + 1
+        return max(1, math.ceil(self._avg_hold * backlog / max(self.max_concurrent, 1)))
+
+    def _reject(self, reason):
+        ADMISSION_REJECTED.labels(self.name, reason).inc()
+        raise Overloaded(reason, self._retry_after())
+
+    def acquire(self, user_id):
+        start = time.monotonic()
+        with self._lock:
+            # 有空闲名额时队列里只剩被单用户上限卡住的请求，只要本用户没有排队就可以直接放行
+            if self._has_capacity(user_id) and not self._waiting_per_user.get(user_id):
+                self._grant(user_id)
+                ADMISSION_QUEUE_WAIT_SECONDS.labels(self.name).observe(0)
+                return Ticket(self, user_id)
+            if len(self._waiters) >= self.max_queue:
+                self._reject("queue_full")
+            if self._waiting_per_user.get(user_id, 0) >= self.max_queue_per_user:
+                self._reject("user_queue_full")
+            waiter = _Waiter(user_id)
+            self._waiters.append(waiter)
+            self._waiting_per_user[user_id] = self._waiting_per_user.get(user_id, 0) + 1
+
+        waiter.event.wait(self.queue_timeout)
+
+        with self._lock:
+            # 超时与被唤醒可能同时发生，以 granted 为准
+            if not waiter.granted:
+                self._waiters.remove(waiter)
+                self._dec_waiting(user_id)
+                self._reject("queue_timeout")
+        ADMISSION_QUEUE_WAIT_SECONDS.labels(self.name).observe(time.monotonic() - start)
+        return Ticket(self, user_id)
+
+    def _dec_waiting(self, user_id):
+        remaining = self._waiting_per_user[user_id] - 1
+        if remaining:
+            self._waiting_per_user[user_id] = remaining
+        else:
+            del self._waiting_per_user[user_id]
+
+    def _release(self, ticket):
+        with self._lock:
+            self._active -= 1
+            remaining = self._active_per_user[ticket.user_id] - 1
+            if remaining:
+                self._active_per_user[ticket.user_id] = remaining
+            else:
+                del self._active_per_user[ticket.user_id]
+            ADMISSION_ACTIVE.labels(self.name).dec()
+            self._avg_hold = 0.9 * self._avg_hold + 0.1 * (time.monotonic() - ticket.admitted_at)
+
+            # 按队列顺序唤醒有余量的等待者（跳过已达单用户上限的用户）
+            for waiter in list(self._waiters):
+                if not self._has_capacity(waiter.user_id):
+                    if self._active >= self.max_concurrent:
+                        break
+                    continue
+                self._waiters.remove(waiter)
+                self._dec_waiting(waiter.user_id)
+                self._grant(waiter.user_id)
+                waiter.granted = True
+                waiter.event.set()
+
+
+# LLM/嵌入/浏览器等重资源接口共享的准入控制器
+llm_admission = AdmissionController(
+    "llm",
+    max_concurrent=ADMISSION_MAX_CONCURRENT,
+    max_per_user=ADMISSION_MAX_PER_USER,
+    max_queue=ADMISSION_MAX_QUEUE,
+    max_queue_per_user=ADMISSION_MAX_QUEUE_PER_USER,
+    queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+)
+
+
+def admission_controlled(controller):
+    """
+    Flask view decorator: admit the request through controller or answer 429 with Retry-After.
+
+    The slot is held until the response is closed, so streamed responses keep it
+    for the whole SSE stream. A view that keeps working after the response closes
+    can take over the slot with take_request_ticket().
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            data = request.get_json(silent=True)
+            user_id = (data.get('user_id') if isinstance(data, dict) else None) or request.remote_addr
+            try:
+                ticket = controller.acquire(user_id)
+            except Overloaded as e:
+                response = jsonify({"error": str(e)})
+                response.status_code = 429
+                response.headers["Retry-After"] = str(e.retry_after)
+                return response
+
+            g.admission_ticket = ticket
+            try:
+                response = make_response(view(*args, **kwargs))
+            except BaseException:
+                ticket.release()
+                raise
+            if g.pop('admission_ticket', None) is not None:
+                response.call_on_close(ticket.release)
+            return response
+        return wrapper
+    return decorator
+
+
+def take_request_ticket():
+    """Take ownership of the current request's admission slot; the caller must release it"""
+    return g.pop('admission_ticket', None)
@@ -1,30 +1,97 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, g
 from flask_cors import CORS
 import os
 import tempfile
-import traceback
 import requests
-from src.memory_store import export_qdrant_snapshot, import_qdrant_snapshot
-from src.config import get_collection_name, get_user_memory, config, openai_client, llm, global_memory
+from src.memory_store import export_qdrant_snapshot, import_qdrant_snapshot, search_memory_candidates, start_snapshot_gc
+from src.memory_delta import export_memory_delta, import_memory_delta
+from src.memory_archive import export_memory_archive, import_memory_archive, is_memory_archive
+from src.purge import start_purge_job, get_purge_job
+from src.warmup import get_warmup_state
+from src.search_params import resolve_search_params, qdrant_search_params
+from src.retrieval import call_with_deadline, last_memories
+from src.episodic_cache import episodic_prompts, DEFAULT_PROMPT as EPISODIC_DEFAULT_PROMPT
+from src.config import get_collection_name, get_user_memory, evict_user_memory, config, openai_client, llm, global_memory
+from src.config import PURGE_WORKERS, PURGE_WORKERS_MAX, MEMORY_RERANK_ENABLED, MMR_LAMBDA, MEMORY_TOKEN_BUDGET, RETRIEVAL_BUDGET, RETRIEVAL_BUDGET_MAX
+from src.rerank import select_memories
 import logging
-from flask import Response, stream_with_context
-import json
+from flask import Response
 from langchain_core.messages import HumanMessage, SystemMessage
 from src.memory_v2 import add_episodic_memory
 from werkzeug.exceptions import HTTPException
 from src.utils import extract_chatgpt_share_from_link
-
-# Set up logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+from src.metrics import track_call, track_stage, track_stream, observe_stage, render_metrics, HTTP_REQUESTS, RETRIEVAL_DEGRADED
+from src.profiling import start_request_profiler, set_active_profiler
+from src.logging_setup import setup_logging, set_log_context
+from src.admission import admission_controlled, llm_admission
+from src.response_cache import response_cache
+from src.memory_version import get_generation, bump_generation, memory_changed
+from src.sse import stream_response, resume_response
+from src.singleflight import SingleFlight
+import time
+
+# Set up logging（异步队列输出，避免请求线程被终端/磁盘 I/O 阻塞）
+setup_logging()
 logger = logging.getLogger(__name__)
 
+# 相同参数的并发检索/嵌入只发起一次后端调用（双击提交、共享 default_user 等）
+embedding_flight = SingleFlight("query_embedding")
+search_flight = SingleFlight("memory_search")
+
 # Initializing the Flask application
 app = Flask(__name__)
 CORS(app)
 
+@app.before_request
+def bind_log_context():
+    data = request.get_json(silent=True)
+    user_id = data.get('user_id') if isinstance(data, dict) else request.form.get('user_id')
+    set_log_context(route=request.path, user_id=user_id)
+
+@app.before_request
+def start_profiler():
+    profiler = start_request_profiler(request)
+    # 每个请求都要设置，工作线程会复用上一个请求的上下文
+    set_active_profiler(profiler)
+    if profiler is not None:
+        g.profiler = profiler
+
+# 流式对话接口：可续传的断线重连只回放缓冲，不占用准入名额，因此在准入检查之前处理
+STREAMING_ENDPOINTS = {'chat', 'chatV2'}
+
+@app.before_request
+def resume_stream_before_admission():
+    if request.endpoint in STREAMING_ENDPOINTS and request.headers.get('Last-Event-ID'):
+        return resume_response(request.headers.get('Last-Event-ID'))
+
+@app.after_request
+def count_request(response):
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    HTTP_REQUESTS.labels(route, request.method, response.status_code).inc()
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        # 流式响应在生成器结束后才关闭，采样覆盖整个 SSE 过程
+        response.call_on_close(profiler.stop)
+    return response
+
+@app.teardown_request
+def stop_profiler(error=None):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.stop()
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Expose metrics in Prometheus text format"""
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+@app.route('/api/ready', methods=['GET'])
+def ready():
+    """Readiness probe: 503 until startup warm-up has finished"""
+    state = get_warmup_state()
+    return jsonify(state), 200 if state["status"] == "ready" else 503
+
 @app.route('/api/export-memory', methods=['POST'])
 def export_memory():
     """Export memory snapshot and return file download"""
@@ -32,8 +99,12 @@ def export_memory():
         data = request.json or {}
         user_id = data.get('user_id', 'default_user')
 
-        # 使用用户特定集合导出快照
-        snapshot_path = export_qdrant_snapshot(user_id=user_id)
+        # format=archive 导出紧凑的可移植归档，否则导出 Qdrant 快照
+        if data.get('format') == 'archive':
+            snapshot_path = export_memory_archive(user_id=user_id, dtype=data.get('vector_dtype', 'int8'))
+        else:
+            # 使用用户特定集合导出快照
+            snapshot_path = export_qdrant_snapshot(user_id=user_id)
 
         if not snapshot_path or not os.path.exists(snapshot_path):
             return jsonify({"error": "Snapshot export failed"}), 500
@@ -45,9 +116,10 @@ def export_memory():
             download_name=os.path.basename(snapshot_path),
             mimetype='application/octet-stream'
         )
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
     except Exception as e:
-        print(f"Export Error: {str(e)}")
-        traceback.print_exc()
+        logger.exception("Export Error: %s", e)
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/import-memory', methods=['POST'])
@@ -60,47 +132,107 @@ def import_memory():
 
         # 检查是否有上传的文件
         if 'snapshot' not in request.files:
-            print("Uploaded file not found")
+            logger.info("Uploaded file not found")
             return jsonify({"error": "Uploaded file not found"}), 400
 
         file = request.files['snapshot']
 
         # Check the file name
         if file.filename == '':
-            print("No file selected")
-            logger.debug("No file selected: %s", file.filename)
+            logger.info("No file selected: %s", file.filename)
             return jsonify({"error": "No file selected"}), 400
 
-        print(f"Received file: {file.filename}")
+        logger.info("Received file: %s", file.filename)
 
         # Save temporary files
         temp_file_path = tempfile.mktemp(suffix='.snapshot')
         file.save(temp_file_path)
 
         file_size = os.path.getsize(temp_file_path)
-        print(f"Saved temporary file: {temp_file_path}, size: {file_size} bytes")
+        logger.info("Saved temporary file: %s, size: %d bytes", temp_file_path, file_size)
 
-        # Importing a Snapshot
-        success = import_qdrant_snapshot(temp_file_path, user_id=user_id)
+        # Importing a Snapshot（根据文件头识别归档格式）
+        if is_memory_archive(temp_file_path):
+            success = import_memory_archive(temp_file_path, user_id=user_id)
+        else:
+            success = import_qdrant_snapshot(temp_file_path, user_id=user_id)
 
         if success:
-            print("Import Success")
+            logger.info("Import Success")
             return jsonify({"message": "Memory snapshot imported successfully"})
         else:
-            print("Import failed")
+            logger.warning("Import failed")
             return jsonify({"error": "Memory snapshot import failed"}), 500
+    except ValueError as ve:
+        logger.warning("Archive import rejected: %s", ve)
+        return jsonify({"error": str(ve)}), 400
     except Exception as e:
-        print(f"An error occurred during the import process: {str(e)}")
-        traceback.print_exc()
+        logger.exception("An error occurred during the import process: %s", e)
         return jsonify({"error": str(e)}), 500
     finally:
         # Make sure to delete temporary files
         if temp_file_path and os.path.exists(temp_file_path):
             try:
                 os.unlink(temp_file_path)
-                print(f"Temporary file deleted: {temp_file_path}")
+                logger.debug("Temporary file deleted: %s", temp_file_path)
             except Exception as e:
-                print(f"Failed to delete temporary file: {str(e)}")
+                logger.warning("Failed to delete temporary file: %s", e)
+
+@app.route('/api/export-memory-delta', methods=['POST'])
+def export_memory_delta_route():
+    """Export the changes since a previous export token and return file download"""
+    temp_file_path = None
+    try:
+        data = request.json or {}
+        user_id = data.get('user_id', 'default_user')
+        since = data.get('since')
+
+        temp_file_path = tempfile.mktemp(suffix='.delta.json.gz')
+        token = export_memory_delta(temp_file_path, user_id=user_id, since=since)
+
+        response = send_file(
+            temp_file_path,
+            as_attachment=True,
+            download_name=f"{get_collection_name(user_id)}_delta_{token}.json.gz",
+            mimetype='application/gzip'
+        )
+        response.headers["X-Export-Token"] = token
+        # 文件发送完成后再删除临时文件
+        cleanup_path, temp_file_path = temp_file_path, None
+        response.call_on_close(lambda: os.path.exists(cleanup_path) and os.unlink(cleanup_path))
+        return response
+    except ValueError as ve:
+        logger.warning("Delta export rejected: %s", ve)
+        return jsonify({"error": str(ve)}), 400
+    except Exception as e:
+        logger.exception("Delta export error: %s", e)
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if temp_file_path and os.path.exists(temp_file_path):
+            os.unlink(temp_file_path)
+
+@app.route('/api/import-memory-delta', methods=['POST'])
+def import_memory_delta_route():
+    """Apply an uploaded delta file without rebuilding the collection"""
+    temp_file_path = None
+    try:
+        user_id = request.form.get('user_id', 'default_user')
+
+        if 'delta' not in request.files or request.files['delta'].filename == '':
+            return jsonify({"error": "Uploaded file not found"}), 400
+
+        temp_file_path = tempfile.mktemp(suffix='.delta.json.gz')
+        request.files['delta'].save(temp_file_path)
+
+        if import_memory_delta(temp_file_path, user_id=user_id):
+            return jsonify({"message": "Memory delta imported successfully"})
+        return jsonify({"error": "Memory delta import failed"}), 500
+    except Exception as e:
+        logger.exception("An error occurred during the delta import: %s", e)
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if temp_file_path and os.path.exists(temp_file_path):
+            os.unlink(temp_file_path)
 
 @app.route('/api/del-memory', methods=['POST'])
 def delete_memory():
@@ -111,27 +243,65 @@ def delete_memory():
 
         user_id = data.get('user_id', 'default_user')
         collection_name = get_collection_name(user_id)
-        print(f"Deleting memory for user {user_id} from collection {collection_name}")
+        logger.info("Deleting memory for user %s from collection %s", user_id, collection_name)
 
         qdrant_host = config["vector_store"]["config"]["host"]
         qdrant_port = config["vector_store"]["config"]["port"]
 
         request_url = f"http://{qdrant_host}:{qdrant_port}/collections/{collection_name}"
-        response = requests.delete(request_url)
+        with track_call("qdrant", "delete_collection"):
+            response = requests.delete(request_url)
 
         if response.status_code != 200:
-            print(f"Failed to delete memory: {response.text}")
+            logger.error("Failed to delete memory: %s", response.text)
             return jsonify({"error": f"Failed to delete memory for user {user_id}"}), 500
+        evict_user_memory(user_id)
+        last_memories.invalidate(user_id)
+        episodic_prompts.forget(user_id)
+        bump_generation(user_id)
 
         return jsonify({"message": f"Memory for user {user_id} deleted"}), 200
 
     except Exception as e:
         if isinstance(e, HTTPException) and e.code:
             return jsonify({"error": str(e.description)}), e.code
-        print(f"Error parsing request data: {str(e)}")
+        logger.exception("Error parsing request data: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/purge-users', methods=['POST'])
+def purge_users():
+    """Start purging all data for many users; progress is polled by job id"""
+    try:
+        data = request.json or {}
+        user_ids = data.get('user_ids')
+        if not isinstance(user_ids, list) or not user_ids:
+            return jsonify({"error": "user_ids must be a non-empty list"}), 400
+
+        workers = data.get('workers', PURGE_WORKERS)
+        if isinstance(workers, bool) or not isinstance(workers, int) or workers < 1:
+            return jsonify({"error": "workers must be a positive integer"}), 400
+
+        job = start_purge_job(user_ids, workers=min(workers, PURGE_WORKERS_MAX))
+        logger.info("Started purge job %s for %d users", job.id, len(job.user_ids))
+        return jsonify(job.to_dict()), 202
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+    except Exception as e:
+        if isinstance(e, HTTPException) and e.code:
+            return jsonify({"error": str(e.description)}), e.code
+        logger.exception("Purge Error: %s", e)
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/purge-users/<job_id>', methods=['GET'])
+def purge_users_status(job_id):
+    """Report the progress of a purge job"""
+    job = get_purge_job(job_id)
+    if job is None:
+        return jsonify({"error": f"Job {job_id} not found"}), 404
+    return jsonify(job.to_dict()), 200
+
 @app.route('/api/chat', methods=['POST'])
+@admission_controlled(llm_admission)
 def chat():
     """Handle chat requests and return AI responses in a streaming manner"""
     try:
@@ -142,66 +312,158 @@ def chat():
 
         message = data['message']
         user_id = data.get('user_id', 'default_user')
+        try:
+            search = resolve_search_params("chat", data.get('search'))
+        except ValueError as ve:
+            return jsonify({"error": str(ve)}), 400
+        retrieval_budget = data.get('retrieval_budget', RETRIEVAL_BUDGET)
+        if isinstance(retrieval_budget, bool) or not isinstance(retrieval_budget, (int, float)) \
+                or not 0 <= retrieval_budget <= RETRIEVAL_BUDGET_MAX:
+            return jsonify({"error": f"retrieval_budget must be between 0 and {RETRIEVAL_BUDGET_MAX} seconds"}), 400
 
-        print(f"Received chat message from user {user_id}: {message}")
+        logger.debug("Received chat message: %s", message)
 
         # Use a generator function for streaming response
         def generate():
-            try:
-                # 为特定用户获取内存实例
-                user_memory = get_user_memory(user_id)
-
-                # 获取相关内存
-                relevant_memories = user_memory.search(query=message, user_id=user_id, limit=10)
-                memories_str = "\n".join(f"- {entry['memory']}" for entry in relevant_memories["results"])
-
-                # 生成助手响应
-                system_prompt = f"You are a helpful AI. Answer the question based on query and memories.\nUser Memories:\n{memories_str}"
-                messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": message}]
-
-                # Use streaming output
-                stream = openai_client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=messages,
-                    stream=True
-                )
-
-                # Collect the complete response for storage
-                assistant_response = ""
-
-                for chunk in stream:
-                    if hasattr(chunk.choices[0], 'delta') and hasattr(chunk.choices[0].delta, 'content'):
-                        content = chunk.choices[0].delta.content
-                        if content:
-                            # Send data in SSE format
-                            yield f"data: {json.dumps({'content': content})}\n\n"
-                            assistant_response += content
-
-                # Create new conversation memory
-                messages.append({"role": "assistant", "content": assistant_response})
-                user_memory.add(messages, user_id=user_id)
-
-                # Send end marker
-                yield f"data: {json.dumps({'done': True})}\n\n"
-            except Exception as e:
-                print(f"Error generating response: {str(e)}")
-                traceback.print_exc()
-                yield f"data: {json.dumps({'error': str(e)})}\n\n"
-                yield f"data: {json.dumps({'done': True})}\n\n"
-
-        return Response(stream_with_context(generate()),
-                        mimetype="text/event-stream",
-                        headers={"Cache-Control": "no-cache",
-                                "X-Accel-Buffering": "no",
-                                "Access-Control-Allow-Origin": "*"})
+            with track_stream("chat"):
+                timings = {}
+                try:
+                    # 检索阶段（获取内存实例+嵌入+检索）限时执行，超时或失败时降级为上次的记忆集合；
+                    # 内存实例未命中缓存时需要访问 Qdrant，同样计入预算
+                    deadline = time.monotonic() + retrieval_budget if retrieval_budget else None
+                    generation = get_generation(user_id)
+                    user_memory = None
+                    query_vector = None
+                    cached_chunks = None
+                    degraded = None
+                    try:
+                        # 为特定用户获取内存实例
+                        with track_stage("chat", "get_user_memory", timings):
+                            user_memory = call_with_deadline(deadline, get_user_memory, user_id)
+
+                        # 缓存查找与重排检索共用同一个查询向量
+                        if response_cache.enabled or MEMORY_RERANK_ENABLED:
+                            with track_stage("chat", "embed_query", timings), track_call("ollama", "embed_query"):
+                                query_vector = call_with_deadline(
+                                    deadline, embedding_flight.do,
+                                    ("embed", message), user_memory.embedding_model.embed, message, "search"
+                                )
+
+                        # 语义缓存：同一用户、同一记忆版本下足够相似的问题直接回放答案
+                        if response_cache.enabled:
+                            cached_chunks = response_cache.lookup(user_id, query_vector, generation)
+
+                        # 获取相关内存
+                        if cached_chunks is None and MEMORY_RERANK_ENABLED:
+                            with track_stage("chat", "search", timings):
+                                candidates = call_with_deadline(
+                                    deadline, search_flight.do,
+                                    ("candidates", user_id, message, tuple(sorted(search.items()))),
+                                    search_memory_candidates, query_vector, user_id=user_id, limit=search["limit"],
+                                    search_params=qdrant_search_params(search)
+                                )
+                            with track_stage("chat", "rerank", timings):
+                                memories_str = "\n".join(select_memories(
+                                    query_vector, candidates, search["top_k"], MEMORY_TOKEN_BUDGET, MMR_LAMBDA
+                                ))
+                            last_memories.put(user_id, memories_str)
+                        elif cached_chunks is None:
+                            with track_stage("chat", "search", timings), track_call("mem0", "search"):
+                                relevant_memories = call_with_deadline(
+                                    deadline, search_flight.do,
+                                    ("search", user_id, message, search["top_k"]),
+                                    user_memory.search, query=message, user_id=user_id, limit=search["top_k"]
+                                )
+                            memories_str = "\n".join(f"- {entry['memory']}" for entry in relevant_memories["results"])
+                            last_memories.put(user_id, memories_str)
+                    except Exception as e:
+                        degraded = "timeout" if isinstance(e, TimeoutError) else "error"
+                        RETRIEVAL_DEGRADED.labels("chat", degraded).inc()
+                        memories_str = last_memories.get(user_id)
+                        fallback = "last_known" if memories_str is not None else "empty"
+                        memories_str = memories_str or ""
+                        logger.warning("Retrieval degraded (%s), using %s memories: %s", degraded, fallback, e)
+                        yield {'meta': {'degraded': True, 'reason': degraded, 'fallback': fallback}}
+
+                    if cached_chunks is not None:
+                        for content in cached_chunks:
+                            yield {'content': content}
+                        yield {'done': True}
+                        logger.info("chat served from response cache", extra={"stages": timings})
+                        return
+
+                    # 生成助手响应
+                    system_prompt = f"You are a helpful AI. Answer the question based on query and memories.\nUser Memories:\n{memories_str}"
+                    messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": message}]
+
+                    # Use streaming output
+                    llm_start = time.perf_counter()
+                    with track_call("openai", "chat_completion"):
+                        stream = openai_client.chat.completions.create(
+                            model="gpt-4o-mini",
+                            messages=messages,
+                            stream=True
+                        )
+
+                    # Collect the complete response for storage
+                    assistant_response = ""
+                    chunks = []
+                    first_token_at = None
+
+                    for chunk in stream:
+                        if hasattr(chunk.choices[0], 'delta') and hasattr(chunk.choices[0].delta, 'content'):
+                            content = chunk.choices[0].delta.content
+                            if content:
+                                if first_token_at is None:
+                                    first_token_at = time.perf_counter()
+                                    observe_stage("chat", "ttft", first_token_at - llm_start, timings)
+                                # Send data as an SSE event
+                                yield {'content': content}
+                                assistant_response += content
+                                chunks.append(content)
+                    observe_stage("chat", "stream", time.perf_counter() - (first_token_at or llm_start), timings)
+
+                    # 先按生成时的记忆版本缓存，若随后的写入改变了记忆会立即失效；降级的回答不缓存
+                    if response_cache.enabled and not degraded:
+                        response_cache.store(user_id, query_vector, generation, chunks)
+
+                    # Create new conversation memory
+                    messages.append({"role": "assistant", "content": assistant_response})
+                    if user_memory is None:
+                        # 检索阶段未能及时拿到实例：回答已发出，此时再等待构建（同一用户的构建只进行一次）
+                        with track_stage("chat", "get_user_memory", timings):
+                            user_memory = get_user_memory(user_id)
+                    with track_stage("chat", "memory_add", timings), track_call("mem0", "add"):
+                        add_result = user_memory.add(messages, user_id=user_id)
+                    if memory_changed(add_result):
+                        bump_generation(user_id)
+                    logger.info("chat completed", extra={"stages": timings, "degraded": degraded})
+
+                    # Send end marker
+                    yield {'done': True, 'degraded': True} if degraded else {'done': True}
+                except Exception as e:
+                    logger.exception("Error generating response: %s", e)
+                    yield {'error': str(e)}
+                    yield {'done': True}
+
+        return stream_response(generate())
 
     except Exception as e:
-        print(f"Error handling chat request: {str(e)}")
-        traceback.print_exc()
+        logger.exception("Error handling chat request: %s", e)
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/stream/<stream_id>', methods=['GET'])
+def resume_stream(stream_id):
+    """Resume an SSE stream from the replay buffer (EventSource reconnects)"""
+    last_event_id = request.headers.get('Last-Event-ID') or f"{stream_id}:-1"
+    resumed = resume_response(last_event_id)
+    if resumed is None:
+        return jsonify({"error": f"Stream {stream_id} not found"}), 404
+    return resumed
+
 # 增加工作记忆
 @app.route('/api/chatV2', methods=['POST'])
+@admission_controlled(llm_admission)
 def chatV2():
     """Handle chat requests and return AI responses in a streaming manner"""
     try:
@@ -212,59 +474,64 @@ def chatV2():
 
         message = data['message']
         user_id = data.get('user_id', 'default_user')
+        try:
+            episodic_search = resolve_search_params("episodic", data.get('search'))
+        except ValueError as ve:
+            return jsonify({"error": str(ve)}), 400
 
-        print(f"Received chat message from user {user_id}: {message}")
+        logger.debug("Received chat message: %s", message)
 
         # 使用langchain请求ds返回数据
         # 将对话输入和输出append到message
 
         # Use a generator function for streaming response
         def generate():
-            try:
-
-                # 初始化或获取用户对话历史
-                if user_id not in global_memory:
-                    system_prompt = SystemMessage(
-                        content="You are a helpful AI Assistant. Answer the User's queries succinctly in one sentence."
-                    )
-                    global_memory[user_id] = [system_prompt]
-
-                messages = global_memory[user_id]
-                # 添加用户进行对话
-                user_message = HumanMessage(content=message)
-                messages.append(user_message)
-
-                response = llm.invoke(messages)
-                print("\nAI Message: ", response.content)
-                yield f"data: {json.dumps({'content': response.content})}\n\n"
-
-                # 添加AI返回对话
-                messages.append(response)
-                # user_memory.add(messages, user_id=user_id)
-
-                for i, msg in enumerate(messages, start=0):
-                    print(f"Message {i} - {msg.type.upper()}: {msg.content}")
-
-                # Send end marker
-                yield f"data: {json.dumps({'done': True})}\n\n"
-            except Exception as e:
-                print(f"Error generating response: {str(e)}")
-                traceback.print_exc()
-                yield f"data: {json.dumps({'error': str(e)})}\n\n"
-                yield f"data: {json.dumps({'done': True})}\n\n"
-
-        return Response(stream_with_context(generate()),
-                        mimetype="text/event-stream",
-                        headers={"Cache-Control": "no-cache",
-                                "X-Accel-Buffering": "no",
-                                "Access-Control-Allow-Origin": "*"})
+            with track_stream("chatV2"):
+                try:
+
+                    # 初始化或获取用户对话历史
+                    if user_id not in global_memory:
+                        global_memory[user_id] = [SystemMessage(content=EPISODIC_DEFAULT_PROMPT)]
+
+                    messages = global_memory[user_id]
+                    # 系统提示词取自情景记忆缓存，不在本轮同步检索；缓存由后台刷新
+                    messages[0] = episodic_prompts.get(user_id, message, episodic_search)
+                    # 添加用户进行对话
+                    user_message = HumanMessage(content=message)
+                    messages.append(user_message)
+
+                    timings = {}
+                    with track_stage("chatV2", "llm", timings), track_call("openai", "chat_invoke"):
+                        response = llm.invoke(messages)
+                    logger.debug("AI Message: %s", response.content)
+                    yield {'content': response.content}
+
+                    # 添加AI返回对话
+                    messages.append(response)
+                    # user_memory.add(messages, user_id=user_id)
+
+                    # 完整历史只在 DEBUG 级别输出，避免每轮对话 O(history) 的日志开销
+                    logger.info("chatV2 turn completed", extra={"stages": timings, "history_length": len(messages)})
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("Conversation history", extra={
+                            "history": [f"{msg.type.upper()}: {msg.content}" for msg in messages]
+                        })
+
+                    # Send end marker
+                    yield {'done': True}
+                except Exception as e:
+                    logger.exception("Error generating response: %s", e)
+                    yield {'error': str(e)}
+                    yield {'done': True}
+
+        return stream_response(generate())
 
     except Exception as e:
-        print(f"Error handling chat request: {str(e)}")
-        traceback.print_exc()
+        logger.exception("Error handling chat request: %s", e)
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/save_episodic_memory', methods=['POST'])
+@admission_controlled(llm_admission)
 def save_episodic():
     try:
         data: dict[str, str] | None = request.json
@@ -275,10 +542,11 @@ def save_episodic():
         # 如何为空直接返回
         if not messages:
             return jsonify({"error": "no conversation"}), 500
-        add_episodic_memory(messages, user_id)  # 调用新版存储方法
+        with track_stage("save_episodic_memory", "add_episodic_memory"):
+            add_episodic_memory(messages, user_id)  # 调用新版存储方法
         return jsonify({"status": "success"})
     except Exception as e:
-        logger.error(f"Save error: {str(e)}")
+        logger.exception("Save error: %s", e)
         if isinstance(e, HTTPException) and e.code:
             return jsonify({"error": str(e.description)}), e.code
         return jsonify({"error": str(e)}), 500
@@ -293,6 +561,7 @@ def delete_episodic_memory():
             return jsonify({"error": "user_id is required"}), 400
 
         user_id = data['user_id']
+        episodic_prompts.forget(user_id)
 
         # 检查用户是否存在
         if user_id not in global_memory:
@@ -308,11 +577,11 @@ def delete_episodic_memory():
         }), 200
 
     except Exception as e:
-        print(f"Deletion Error: {str(e)}")
-        traceback.print_exc()
+        logger.exception("Deletion Error: %s", e)
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/chatgpt-share', methods=['POST'])
+@admission_controlled(llm_admission)
 def extract_chatgpt_share():
     """
     Extract messages from a public ChatGPT share URL.
@@ -324,19 +593,19 @@ def extract_chatgpt_share():
             return jsonify({"error": "URL is required"}), 400
 
         url = data['url']
-        print(f"Extracting messages from URL: {url}")
+        logger.info("Extracting messages from URL: %s", url)
 
         messages = extract_chatgpt_share_from_link(url)
         return jsonify({"messages": messages}), 200
 
     except ValueError as ve:
-        print(f"Value Error: {str(ve)}")
+        logger.warning("Value Error: %s", ve)
         return jsonify({"error": str(ve)}), 400
     except Exception as e:
-        print(f"Error extracting messages: {str(e)}")
-        traceback.print_exc()
+        logger.exception("Error extracting messages: %s", e)
         return jsonify({"error": str(e)}), 500
 
 def run_api(host='localhost', port=5000, debug=False):
     """Run the API server"""
+    start_snapshot_gc()
     app.run(host=host, port=port, debug=debug, use_reloader=debug)
\ No newline at end of file
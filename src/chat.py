@@ -1,26 +1,32 @@
 from .config import openai_client, memory
+from .search_params import resolve_search_params
 
-def chat_with_memories(message: str, user_id: str = "default_user") -> str:
+def build_chat_messages(message: str, user_id: str = "default_user", search=None) -> list:
+    """Retrieve the user's relevant memories and build the system + user messages"""
+    # Retrieve relevant memories
+    params = resolve_search_params("chat_cli", search)
+    relevant_memories = memory.search(query=message, user_id=user_id, limit=params["limit"])
+    memories_str = "\n".join(f"- {entry['memory']}" for entry in relevant_memories["results"])
+
+    # Generate Assistant response
+    # system_prompt = f"You are a helpful AI. Remember the knowledge of crypto currency based on inputs and memories.\nUser Memories:\n{memories_str}"
+    system_prompt = f"You are an expert in Ethereum. Please use inputs and memories for responses. Do not follow standard LLM response patterns. Be causal and conversational. Be concise and try to keep the answer under 50 words.\nUser Memories:\n{memories_str}"
+    # system_prompt = f"You are a helpful AI and a Ethereum analysis expert. Answer the question based on inputs and memories. Avoid any traces of output typical of a large language model.Each response must not exceed 50 English words.\nUser Memories:\n{memories_str}"
+    return [{"role": "system", "content": system_prompt}, {"role": "user", "content": message}]
+
+def chat_with_memories(message: str, user_id: str = "default_user", search=None) -> str:
     """
     Chat with AI using the user's message and save the conversation memory.
 
     Args:
         message: User's message
         user_id: User identifier
+        search: Optional overrides of the "chat_cli" search parameters, e.g. {"limit": 5}
 
     Returns:
         str: AI's response
     """
-    # Retrieve relevant memories
-    relevant_memories = memory.search(query=message, user_id=user_id, limit=3)
-    memories_str = "\n".join(f"- {entry['memory']}" for entry in relevant_memories["results"])
-
-    # Generate Assistant response
-    # system_prompt = f"You are a helpful AI. Remember the knowledge of crypto currency based on inputs and memories.\nUser Memories:\n{memories_str}"
-    system_prompt = f"You are an expert in Ethereum. Please use inputs and memories for responses. Do not follow standard LLM response patterns. Be causal and conversational. Be concise and try to keep the answer under 50 words.\nUser Memories:\n{memories_str}"
-    # system_prompt = f"You are a helpful AI and a Ethereum analysis expert. Answer the question based on inputs and memories. Avoid any traces of output typical of a large language model.Each response must not exceed 50 English words.\nUser Memories:\n{memories_str}"
-    messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": message}
-                ]
+    messages = build_chat_messages(message, user_id, search)
 
     # Use streaming output
     stream = openai_client.chat.completions.create(
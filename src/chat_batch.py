@@ -0,0 +1,209 @@
+import sys
+import json
+import time
+import argparse
+import threading
+import traceback
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from .config import openai_client, memory
+from .chat import build_chat_messages
+from .search_params import resolve_search_params
+from .metrics import track_stage, track_call
+
+ROUTE = "chat_batch"
+
+
+def read_records(input_path):
+    """Read (user_id, message) records from a JSONL file, keeping their line order as index"""
+    records = []
+    with open(input_path) as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if not record.get("message"):
+                raise ValueError(f"Line {line_number}: message is required")
+            records.append({
+                "index": len(records),
+                "id": record.get("id"),
+                "user_id": record.get("user_id", "default_user"),
+                "message": record["message"],
+            })
+    return records
+
+
+class _ResultWriter:
+    """Appends results to a JSONL file as soon as they are ready"""
+
+    def __init__(self, output_path):
+        self.f = open(output_path, "w") if output_path else sys.stdout
+        self.lock = threading.Lock()
+
+    def write(self, result):
+        line = json.dumps(result, ensure_ascii=False)
+        with self.lock:
+            self.f.write(line + "\n")
+            self.f.flush()
+
+    def close(self):
+        if self.f is not sys.stdout:
+            self.f.close()
+
+
+def _chat_one(record, search, write_memory):
+    timings = {}
+    started = time.perf_counter()
+    with track_stage(ROUTE, "search", timings):
+        messages = build_chat_messages(record["message"], record["user_id"], search)
+    with track_stage(ROUTE, "generate", timings), track_call("openai", "chat_completion"):
+        completion = openai_client.chat.completions.create(model="gpt-4o-mini", messages=messages)
+    response = completion.choices[0].message.content or ""
+    messages.append({"role": "assistant", "content": response})
+
+    if write_memory:
+        with track_stage(ROUTE, "memory_add", timings):
+            memory.add(messages, user_id=record["user_id"])
+    timings["total"] = round(time.perf_counter() - started, 4)
+    return response, messages, timings
+
+
+def _run_records(records, search, write_mode, writer, pending):
+    """Process records in order; a failed record does not stop the rest"""
+    stage_timings = []
+    errors = 0
+    for record in records:
+        result = {"id": record["id"], "index": record["index"], "user_id": record["user_id"]}
+        try:
+            response, messages, timings = _chat_one(record, search, write_mode == "immediate")
+            result.update(response=response, timings=timings)
+            stage_timings.append(timings)
+            if write_mode == "deferred":
+                pending[record["user_id"]].append((record["index"], messages))
+        except Exception as e:
+            errors += 1
+            result["error"] = str(e)
+        writer.write(result)
+    return stage_timings, errors
+
+
+def _flush_writes(user_id, conversations):
+    timings = []
+    errors = 0
+    # 并行生成的完成顺序不确定，按文件顺序写入
+    for _, messages in sorted(conversations, key=lambda item: item[0]):
+        stage = {}
+        try:
+            with track_stage(ROUTE, "memory_add", stage):
+                memory.add(messages, user_id=user_id)
+            timings.append(stage)
+        except Exception as e:
+            errors += 1
+            print(f"Deferred memory write failed for {user_id}: {e}", file=sys.stderr)
+    return timings, errors
+
+
+def _summarize(stage_timings):
+    stages = {}
+    for timings in stage_timings:
+        for stage, seconds in timings.items():
+            stages.setdefault(stage, []).append(seconds)
+    return {
+        stage: {
+            "count": len(values),
+            "mean": round(float(np.mean(values)), 4),
+            "p50": round(float(np.percentile(values, 50)), 4),
+            "p95": round(float(np.percentile(values, 95)), 4),
+        }
+        for stage, values in stages.items()
+    }
+
+
+def run_chat_batch(input_path, output_path=None, workers=8, write_mode="deferred", search=None):
+    """
+    Run chat_with_memories over a JSONL file of {"user_id", "message"} records concurrently
+
+    In "immediate" mode later messages must see earlier memory writes, so each user's
+    records run in file order and only different users run in parallel. Otherwise
+    records do not depend on each other and all of them run in parallel; deferred
+    writes are still applied per user in file order. Results are written to
+    output_path (JSONL) as they complete.
+
+    Args:
+        input_path: JSONL input, one {"user_id", "message", optional "id"} per line
+        output_path: JSONL output, stdout if None
+        workers: Number of records (users in "immediate" mode) processed in parallel
+        write_mode: "deferred" adds memories after all answers are generated,
+            "immediate" adds them after each answer (later messages see earlier ones),
+            "none" never writes memories (offline evaluation)
+        search: Optional overrides of the "chat_cli" search parameters
+
+    Returns:
+        dict: Summary with throughput and per-stage timings
+    """
+    if write_mode not in ("deferred", "immediate", "none"):
+        raise ValueError(f"Unknown write mode: {write_mode}")
+    resolve_search_params("chat_cli", search)  # 参数有误时在开始前报错
+    records = read_records(input_path)
+    by_user = {}
+    for record in records:
+        by_user.setdefault(record["user_id"], []).append(record)
+
+    # 只有 immediate 模式需要按用户串行，其余模式逐条并行
+    units = list(by_user.values()) if write_mode == "immediate" else [[record] for record in records]
+
+    writer = _ResultWriter(output_path)
+    pending = {user_id: [] for user_id in by_user}
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            results = list(executor.map(
+                lambda unit: _run_records(unit, search, write_mode, writer, pending), units
+            ))
+            chat_seconds = time.perf_counter() - started
+
+            # 延迟写入：生成全部完成后再批量写记忆，每个用户内部仍保持顺序
+            write_results = list(executor.map(lambda user_id: _flush_writes(user_id, pending[user_id]),
+                                              [user_id for user_id in by_user if pending[user_id]]))
+    finally:
+        writer.close()
+
+    stage_timings = [timings for user_timings, _ in results for timings in user_timings]
+    stage_timings += [timings for user_timings, _ in write_results for timings in user_timings]
+    errors = sum(user_errors for _, user_errors in results)
+    elapsed = time.perf_counter() - started
+    return {
+        "records": len(records),
+        "users": len(by_user),
+        "errors": errors,
+        "memory_write_errors": sum(user_errors for _, user_errors in write_results),
+        "workers": workers,
+        "write_mode": write_mode,
+        "chat_seconds": round(chat_seconds, 3),
+        "total_seconds": round(elapsed, 3),
+        "throughput_per_second": round(len(records) / chat_seconds, 3) if chat_seconds else None,
+        "stages": _summarize(stage_timings),
+    }
+
+
+def main():
+    """Command line entry point: python -m src.chat_batch input.jsonl -o results.jsonl"""
+    parser = argparse.ArgumentParser(description='Run chat_with_memories over a JSONL file concurrently')
+    parser.add_argument('input', help='JSONL file of {"user_id": ..., "message": ...} records')
+    parser.add_argument('-o', '--output', help='JSONL file for results (default: stdout)')
+    parser.add_argument('--workers', type=int, default=8, help='Number of records processed in parallel (users in immediate mode)')
+    parser.add_argument('--write-mode', choices=['deferred', 'immediate', 'none'], default='deferred',
+                        help='When to add conversations to memory')
+    parser.add_argument('--search', type=json.loads, default=None, help='Search parameter overrides as JSON, e.g. \'{"limit": 5}\'')
+    args = parser.parse_args()
+
+    summary = run_chat_batch(args.input, args.output, args.workers, args.write_mode, args.search)
+    print(json.dumps(summary, indent=2), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception:
+        traceback.print_exc()
+        sys.exit(1)
@@ -3,6 +3,9 @@ from openai import OpenAI
 from mem0 import Memory
 from qdrant_client import QdrantClient
 import os
+import json
+import threading
+from collections import OrderedDict
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from qdrant_client.models import VectorParams, Distance
 from dotenv import load_dotenv
@@ -86,10 +89,40 @@ def get_user_config(user_id="default_user"):
     user_config["vector_store"]["config"]["collection_name"] = get_collection_name(user_id)
     return user_config
 
+# 用户内存实例缓存：Memory.from_config 需要创建客户端并检查集合，开销较大
+USER_MEMORY_CACHE_SIZE = int(os.getenv("ORB_USER_MEMORY_CACHE_SIZE", "256"))
+_user_memories = OrderedDict()
+_user_memory_locks = {}
+_user_memories_lock = threading.Lock()
+
 # 获取用户特定的内存实例
 def get_user_memory(user_id="default_user"):
-    user_config = get_user_config(user_id)
-    return Memory.from_config(user_config)
+    with _user_memories_lock:
+        user_memory = _user_memories.get(user_id)
+        if user_memory is not None:
+            _user_memories.move_to_end(user_id)
+            return user_memory
+        lock = _user_memory_locks.setdefault(user_id, threading.Lock())
+
+    # 同一用户只构建一次，不同用户可并行构建
+    with lock:
+        with _user_memories_lock:
+            user_memory = _user_memories.get(user_id)
+        if user_memory is None:
+            user_config = get_user_config(user_id)
+            user_memory = Memory.from_config(user_config)
+            with _user_memories_lock:
+                _user_memories[user_id] = user_memory
+                while len(_user_memories) > USER_MEMORY_CACHE_SIZE:
+                    evicted, _ = _user_memories.popitem(last=False)
+                    _user_memory_locks.pop(evicted, None)
+    return user_memory
+
+# 集合被删除后必须丢弃缓存的实例，否则其向量库仍指向已不存在的集合
+def evict_user_memory(user_id="default_user"):
+    with _user_memories_lock:
+        _user_memory_locks.pop(user_id, None)
+        return _user_memories.pop(user_id, None) is not None
 
 # 默认内存对象
 memory = Memory.from_config(config)
@@ -118,4 +151,95 @@ def init_user_collection(user_id: str):
         size=config["vector_store"]["config"]["embedding_model_dims"],
         distance=Distance.COSINE
     )
-)
\ No newline at end of file
+)
+
+# 请求级采样分析（默认关闭，开启后可通过请求头/查询参数或按比例采样触发）
+PROFILING_ENABLED = os.getenv("ORB_PROFILING_ENABLED", "0") == "1"
+PROFILE_SAMPLE_RATE = float(os.getenv("ORB_PROFILE_SAMPLE_RATE", "0"))  # 0~1 之间，按比例随机采样请求
+PROFILE_TOKEN = os.getenv("ORB_PROFILE_TOKEN")  # 设置后，X-Orb-Profile 请求头/profile 参数必须与之相同
+PROFILE_INTERVAL = float(os.getenv("ORB_PROFILE_INTERVAL", "0.005"))  # 采样间隔（秒）
+PROFILE_DIR = os.getenv("ORB_PROFILE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "profiles"))
+PROFILE_MAX_BYTES = int(os.getenv("ORB_PROFILE_MAX_BYTES", str(50 * 1024 * 1024)))  # 每个接口目录的最大容量
+
+# 日志配置：日志写入在后台线程完成，不阻塞请求线程和 SSE 生成器
+LOG_LEVEL = os.getenv("ORB_LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("ORB_LOG_FORMAT", "json")  # json 或 text
+LOG_FILE = os.getenv("ORB_LOG_FILE")  # 设置后额外写入滚动日志文件
+LOG_QUEUE_SIZE = int(os.getenv("ORB_LOG_QUEUE_SIZE", "10000"))  # 队列满时丢弃日志而不是阻塞请求
+LOG_SAMPLE_RATE = float(os.getenv("ORB_LOG_SAMPLE_RATE", "1.0"))  # 低于 WARNING 的日志采样比例
+# 按路由设置日志级别，例如 "/api/chatV2=DEBUG,/metrics=WARNING"
+LOG_ROUTE_LEVELS = dict(
+    item.split("=", 1) for item in os.getenv("ORB_LOG_ROUTE_LEVELS", "").split(",") if "=" in item
+)
+
+# LLM 相关接口的准入控制：全局/单用户并发上限 + 有界等待队列
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ORB_ADMISSION_MAX_CONCURRENT", "16"))
+ADMISSION_MAX_PER_USER = int(os.getenv("ORB_ADMISSION_MAX_PER_USER", "2"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ORB_ADMISSION_MAX_QUEUE", "32"))  # 全局最多排队请求数
+ADMISSION_MAX_QUEUE_PER_USER = int(os.getenv("ORB_ADMISSION_MAX_QUEUE_PER_USER", "2"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ORB_ADMISSION_QUEUE_TIMEOUT", "5"))  # 排队最长等待（秒）
+
+# /api/chat 语义响应缓存（默认关闭）
+RESPONSE_CACHE_ENABLED = os.getenv("ORB_RESPONSE_CACHE_ENABLED", "0") == "1"
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("ORB_RESPONSE_CACHE_THRESHOLD", "0.95"))  # 余弦相似度阈值
+RESPONSE_CACHE_TTL = float(os.getenv("ORB_RESPONSE_CACHE_TTL", "3600"))  # 秒
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("ORB_RESPONSE_CACHE_MAX_ENTRIES", "2000"))
+
+# 记忆检索重排：先取较大的候选集，再用 MMR 去冗余并按 token 预算装入提示词
+MEMORY_RERANK_ENABLED = os.getenv("ORB_MEMORY_RERANK_ENABLED", "1") == "1"
+MEMORY_CANDIDATES = int(os.getenv("ORB_MEMORY_CANDIDATES", "50"))
+MEMORY_TOP_K = int(os.getenv("ORB_MEMORY_TOP_K", "10"))
+MMR_LAMBDA = float(os.getenv("ORB_MMR_LAMBDA", "0.5"))  # 1.0 只看相关性，0.0 只看多样性
+MEMORY_TOKEN_BUDGET = int(os.getenv("ORB_MEMORY_TOKEN_BUDGET", "800"))
+EPISODIC_TOKEN_BUDGET = int(os.getenv("ORB_EPISODIC_TOKEN_BUDGET", "300"))
+
+# SSE 流：重连回放缓冲、心跳与小块合并
+SSE_REPLAY_EVENTS = int(os.getenv("ORB_SSE_REPLAY_EVENTS", "4096"))  # 每个流保留的事件数
+SSE_RETENTION = float(os.getenv("ORB_SSE_RETENTION", "120"))  # 流结束后保留多久以供重连（秒）
+SSE_MAX_STREAMS = int(os.getenv("ORB_SSE_MAX_STREAMS", "1000"))
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("ORB_SSE_HEARTBEAT_INTERVAL", "15"))
+SSE_COALESCE_CHARS = int(os.getenv("ORB_SSE_COALESCE_CHARS", "32"))  # 攒够这么多字符再写出
+SSE_COALESCE_DELAY = float(os.getenv("ORB_SSE_COALESCE_DELAY", "0.03"))  # 最多等待这么久（秒）
+
+# 快照保留策略（本地 your_memory/<user_id>/ 与 Qdrant 服务端分别执行）
+MEMORY_EXPORT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "your_memory")
+SNAPSHOT_KEEP_COUNT = int(os.getenv("ORB_SNAPSHOT_KEEP_COUNT", "3"))  # 每个用户/集合最多保留的快照数
+SNAPSHOT_MAX_AGE = float(os.getenv("ORB_SNAPSHOT_MAX_AGE", str(7 * 24 * 3600)))  # 秒
+SNAPSHOT_MAX_BYTES = int(os.getenv("ORB_SNAPSHOT_MAX_BYTES", str(1024 * 1024 * 1024)))  # 每个用户/集合的总大小
+SNAPSHOT_GC_INTERVAL = float(os.getenv("ORB_SNAPSHOT_GC_INTERVAL", "3600"))  # 后台清理间隔（秒），0 表示关闭
+
+# 批量清除用户数据的并发度
+PURGE_WORKERS = int(os.getenv("ORB_PURGE_WORKERS", "8"))
+PURGE_WORKERS_MAX = int(os.getenv("ORB_PURGE_WORKERS_MAX", "32"))  # 请求可指定的最大并发度
+
+# 启动预热：加载嵌入模型、建立连接并预建热点用户的内存实例
+WARMUP_ENABLED = os.getenv("ORB_WARMUP_ENABLED", "1") == "1"
+WARMUP_HOT_USERS = [u.strip() for u in os.getenv("ORB_WARMUP_HOT_USERS", "").split(",") if u.strip()]
+WARMUP_EMBED_MODELS = [m.strip() for m in os.getenv("ORB_WARMUP_EMBED_MODELS", "mxbai-embed-large,nomic-embed-text").split(",") if m.strip()]
+WARMUP_WORKERS = int(os.getenv("ORB_WARMUP_WORKERS", "4"))
+OLLAMA_URL = os.getenv("ORB_OLLAMA_URL", "http://localhost:11434")
+_keep_alive = os.getenv("ORB_OLLAMA_KEEP_ALIVE", "-1")  # -1 表示常驻；也可写 "30m" 之类的时长
+OLLAMA_KEEP_ALIVE = int(_keep_alive) if _keep_alive.lstrip("-").isdigit() else _keep_alive
+
+# 检索参数：按路由的默认值，可用 ORB_SEARCH_PARAMS（JSON，按路由覆盖）整体调整，
+# 例如 '{"chat": {"limit": 30, "hnsw_ef": 128}}'；请求体中的 "search" 字段可再按请求覆盖
+SEARCH_PARAMS = {
+    "chat": {"limit": MEMORY_CANDIDATES, "top_k": MEMORY_TOP_K},  # limit 为 MMR 候选数
+    "chat_cli": {"limit": 3},
+    "episodic": {"limit": 20, "top_k": 3, "alpha": 0.5},  # limit 为每一路召回的候选数
+}
+for _route, _overrides in json.loads(os.getenv("ORB_SEARCH_PARAMS", "{}")).items():
+    SEARCH_PARAMS.setdefault(_route, {}).update(_overrides)
+SEARCH_MAX_LIMIT = int(os.getenv("ORB_SEARCH_MAX_LIMIT", "200"))  # 单次请求可覆盖的候选数上限
+
+# 检索阶段的时间预算：嵌入+检索超时后使用该用户上次的记忆集合（或空集合）继续生成
+RETRIEVAL_BUDGET = float(os.getenv("ORB_RETRIEVAL_BUDGET", "1.5"))  # 秒，0 表示不限时
+RETRIEVAL_BUDGET_MAX = float(os.getenv("ORB_RETRIEVAL_BUDGET_MAX", "10"))  # 请求可指定的最大预算
+RETRIEVAL_WORKERS = int(os.getenv("ORB_RETRIEVAL_WORKERS", "32"))  # 需大于准入并发数，超时任务会继续占用线程
+RETRIEVAL_FALLBACK_USERS = int(os.getenv("ORB_RETRIEVAL_FALLBACK_USERS", "10000"))  # 保留上次记忆集合的用户数
+
+# chatV2 情景记忆系统提示词缓存：后台重建，话题漂移（与上次查询相似度低于阈值）时按新查询刷新
+EPISODIC_PROMPT_CACHE_ENABLED = os.getenv("ORB_EPISODIC_PROMPT_CACHE_ENABLED", "1") == "1"
+EPISODIC_DRIFT_THRESHOLD = float(os.getenv("ORB_EPISODIC_DRIFT_THRESHOLD", "0.75"))  # 余弦相似度
+EPISODIC_PROMPT_WORKERS = int(os.getenv("ORB_EPISODIC_PROMPT_WORKERS", "4"))
+EPISODIC_PROMPT_MAX_USERS = int(os.getenv("ORB_EPISODIC_PROMPT_MAX_USERS", "10000"))
@@ -0,0 +1,143 @@
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from langchain_core.messages import SystemMessage
+from .config import (qdrant_client, get_collection_name, EPISODIC_PROMPT_CACHE_ENABLED, EPISODIC_DRIFT_THRESHOLD,
+                     EPISODIC_PROMPT_WORKERS, EPISODIC_PROMPT_MAX_USERS)
+from .memory_v2 import embed_episodic_query, episodic_recall, render_episodic_prompt
+from .memory_version import on_memory_change
+from .metrics import track_call, EPISODIC_PROMPT_REFRESHES
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROMPT = "You are a helpful AI Assistant. Answer the User's queries succinctly in one sentence."
+
+
+class _Entry:
+    __slots__ = ("message", "query", "vector")
+
+    def __init__(self, message, query, vector):
+        self.message = message
+        self.query = query
+        self.vector = vector
+
+
+def _cosine(a, b):
+    norm = np.linalg.norm(a) * np.linalg.norm(b)
+    return float(a @ b / norm) if norm else 0.0
+
+
+class EpisodicPromptCache:
+    """
+    Per-user cache of the rendered episodic SystemMessage used by chatV2.
+
+    get() never waits on the embedder or Qdrant: it returns the cached prompt (or the
+    default one) and schedules background work. The first query builds the prompt,
+    later queries only embed and compare against the query the prompt was built for,
+    rebuilding when similarity drops below drift_threshold. Memory writes rebuild the
+    prompt for the same query. At most one refresh per user runs at a time; requests
+    arriving meanwhile are merged into one follow-up. forget() drops everything held
+    for a user when their data is deleted.
+    """
+
+    def __init__(self, enabled, drift_threshold, workers, max_users):
+        self.enabled = enabled
+        self.drift_threshold = drift_threshold
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # user_id -> _Entry，按最近使用排序
+        self._running = set()
+        self._pending = {}  # user_id -> (reason, query, search)，当前刷新结束后执行
+        self._epochs = {}  # user_id -> forget() 次数，进行中的刷新在用户被遗忘后不得写回
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="episodic-prompt")
+
+    def get(self, user_id, query, search=None):
+        """Return the cached prompt for user_id and schedule a refresh check for query"""
+        if not self.enabled:
+            return SystemMessage(content=DEFAULT_PROMPT)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                self._entries.move_to_end(user_id)
+        self._schedule(user_id, "drift" if entry is not None else "initial", query, search)
+        return entry.message if entry is not None else SystemMessage(content=DEFAULT_PROMPT)
+
+    def forget(self, user_id):
+        """Drop the cached prompt, query and pending work of a user whose data was deleted"""
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._pending.pop(user_id, None)
+            self._epochs[user_id] = self._epochs.get(user_id, 0) + 1
+
+    def invalidate(self, user_id, generation=None):
+        """Rebuild a cached prompt after the user's memories changed"""
+        with self._lock:
+            known = user_id in self._entries
+        if known:
+            self._schedule(user_id, "memory_change", None, None)
+
+    def _schedule(self, user_id, reason, query, search):
+        with self._lock:
+            if user_id in self._running:
+                # 记忆变化必须重建，不能被之后的漂移检查覆盖
+                if reason != "drift" or self._pending.get(user_id, ("drift",))[0] == "drift":
+                    self._pending[user_id] = (reason, query, search)
+                return
+            self._running.add(user_id)
+        self._executor.submit(self._run, user_id, reason, query, search)
+
+    def _run(self, user_id, reason, query, search):
+        while True:
+            try:
+                if self._refresh(user_id, reason, query, search):
+                    EPISODIC_PROMPT_REFRESHES.labels(reason, "ok").inc()
+            except Exception as e:
+                EPISODIC_PROMPT_REFRESHES.labels(reason, "error").inc()
+                logger.warning("Episodic prompt refresh (%s) failed for %s: %s", reason, user_id, e)
+            with self._lock:
+                follow_up = self._pending.pop(user_id, None)
+                if follow_up is None:
+                    self._running.discard(user_id)
+                    return
+            reason, query, search = follow_up
+
+    def _refresh(self, user_id, reason, query, search):
+        """Rebuild the prompt if needed; returns whether it was rebuilt"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            epoch = self._epochs.get(user_id, 0)
+        if reason == "memory_change":
+            if entry is None:
+                return False
+            query, vector = entry.query, entry.vector  # 同一话题下重建
+        else:
+            vector = np.asarray(embed_episodic_query(query), dtype=np.float32)
+            if entry is not None and _cosine(vector, entry.vector) >= self.drift_threshold:
+                return False
+
+        with track_call("qdrant", "collection_exists"):
+            exists = qdrant_client.collection_exists(get_collection_name(user_id))
+        memories = episodic_recall(query, user_id, search, vector.tolist()) if exists else []
+        message = render_episodic_prompt(memories) if memories else SystemMessage(content=DEFAULT_PROMPT)
+
+        with self._lock:
+            if self._epochs.get(user_id, 0) != epoch:
+                return False
+            self._entries[user_id] = _Entry(message, query, vector)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+        return True
+
+
+episodic_prompts = EpisodicPromptCache(
+    enabled=EPISODIC_PROMPT_CACHE_ENABLED,
+    drift_threshold=EPISODIC_DRIFT_THRESHOLD,
+    workers=EPISODIC_PROMPT_WORKERS,
+    max_users=EPISODIC_PROMPT_MAX_USERS,
+)
+
+# 情景记忆写入（以及导入等）后在后台重建提示词；删除数据的路径需先调用 forget()
+on_memory_change(episodic_prompts.invalidate)
@@ -0,0 +1,132 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import traceback
+from contextvars import ContextVar
+from .config import LOG_LEVEL, LOG_FORMAT, LOG_FILE, LOG_QUEUE_SIZE, LOG_SAMPLE_RATE, LOG_ROUTE_LEVELS
+from .metrics import register_queue, LOG_RECORDS_DROPPED
+
+# 当前请求的日志上下文（user_id、route 等），由 api 在请求开始时设置
+_log_context: ContextVar[dict] = ContextVar("orb_log_context", default={})
+
+# LogRecord 自带的属性，其余属性视为通过 extra 传入的结构化字段
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener = None
+
+
+def set_log_context(**fields):
+    """Attach fields (user_id, route, ...) to every record logged from this context"""
+    _log_context.set({**_log_context.get(), **fields})
+
+
+def clear_log_context():
+    _log_context.set({})
+
+
+class ContextFilter(logging.Filter):
+    """Copies the request context onto the record while still on the request thread"""
+
+    def filter(self, record):
+        for key, value in _log_context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class RouteLevelFilter(logging.Filter):
+    """Applies per-route minimum levels, falling back to the default level"""
+
+    def __init__(self, default_level, route_levels):
+        super().__init__()
+        self.default_level = logging.getLevelName(default_level.upper())
+        self.route_levels = {route: logging.getLevelName(level.upper()) for route, level in route_levels.items()}
+
+    def filter(self, record):
+        level = self.route_levels.get(getattr(record, "route", None), self.default_level)
+        return record.levelno >= level
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a random fraction of records below WARNING"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1.0 or random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
+
+    def prepare(self, record):
+        # 只在请求线程里合并参数和格式化异常，真正的格式化和 I/O 交给后台线程
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = "".join(traceback.format_exception(*record.exc_info)).rstrip()
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+def setup_logging():
+    """Route all logging through a bounded queue drained by a background thread"""
+    global _listener
+    if _listener is not None:
+        return
+
+    if LOG_FORMAT == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    handlers = [logging.StreamHandler(sys.stderr)]
+    if LOG_FILE:
+        handlers.append(logging.handlers.RotatingFileHandler(LOG_FILE, maxBytes=50 * 1024 * 1024, backupCount=5))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(RouteLevelFilter(LOG_LEVEL, LOG_ROUTE_LEVELS))
+    queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+    register_queue("log", log_queue.qsize)
+
+    # 根 logger 放行所有路由中最低的级别，具体过滤交给 RouteLevelFilter
+    levels = [logging.getLevelName(level.upper()) for level in [LOG_LEVEL, *LOG_ROUTE_LEVELS.values()]]
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(min(levels))
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
@@ -1,5 +1,8 @@
 from .api import run_api
+from .config import WARMUP_ENABLED, WARMUP_HOT_USERS
+from .warmup import start_warmup, mark_ready
 import argparse
+import os
 
 def main():
     """Main entry point"""
@@ -7,11 +10,23 @@ def main():
     parser.add_argument('--port', type=int, default=5000, help='API server port')
     parser.add_argument('--host', type=str, default='0.0.0.0', help='API server host')  # Changed to 0.0.0.0 to allow access from any address
     parser.add_argument('--debug', action='store_true', help='Enable debug mode')
+    parser.add_argument('--no-warmup', action='store_true', help='Skip the startup warm-up phase')
+    parser.add_argument('--hot-users', type=str, default=None, help='Comma-separated user IDs whose memory is preloaded during warm-up')
     
     args = parser.parse_args()
+
+    hot_users = WARMUP_HOT_USERS if args.hot_users is None else [u.strip() for u in args.hot_users.split(",") if u.strip()]
+    # 调试模式下重载器的父进程不处理请求，只在实际服务的子进程中预热
+    serving_process = not args.debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true"
+    if WARMUP_ENABLED and not args.no_warmup:
+        if serving_process:
+            print(f"Warming up (hot users: {len(hot_users)})...")
+            start_warmup(hot_users)
+    else:
+        mark_ready()
     
     print(f"Starting API server at {args.host}:{args.port}...")
     run_api(host=args.host, port=args.port, debug=args.debug)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,375 @@
+"""
+Portable memory archive (.orbarchive)
+
+    [MAGIC][padding to 64 bytes]
+    [vector block]    count x dim, float16 or int8, contiguous and memory-mappable
+    [scale block]     float32 per vector (int8 only)
+    [column chunks]   zlib-compressed JSON arrays, one per column per row group
+    [footer JSON][footer length: uint64][MAGIC]
+
+Columns are the payload_schema fields, plus "id" and "extra" (every other payload
+key, so mem0 memories round-trip too). Row groups let readers decompress only the
+rows they need.
+"""
+
+import os
+import json
+import zlib
+import struct
+import datetime
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from qdrant_client.http import models
+from qdrant_client.models import VectorParams, Distance
+from .config import qdrant_client, get_collection_name, payload_schema
+from .memory_store import get_memory_dir
+from .memory_version import bump_generation
+from .metrics import track_call
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"ORBARCH1"
+ARCHIVE_VERSION = 1
+ARCHIVE_SUFFIX = ".orbarchive"
+ALIGNMENT = 64
+ROW_GROUP_SIZE = 4096
+SCROLL_BATCH = 512
+COLUMNS = ["id", *payload_schema.keys(), "extra"]
+VECTOR_DTYPES = ("int8", "float16")
+
+
+def is_memory_archive(path):
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _quantize(vectors, dtype):
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        quantized = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return quantized, scales.astype(np.float32)
+    raise ValueError(f"Unsupported vector dtype: {dtype}")
+
+
+class _ArchiveWriter:
+    """Streams vectors to disk as they arrive and buffers payload columns per row group"""
+
+    def __init__(self, path, dtype):
+        self.path = path
+        self.dtype = dtype
+        self.f = open(path, "wb")
+        self.f.write(MAGIC)
+        self.f.write(b"\0" * (ALIGNMENT - len(MAGIC)))
+        self.dim = None
+        self.count = 0
+        self.scales = []
+        self.rows = {name: [] for name in COLUMNS}
+        self.chunks = {name: [] for name in COLUMNS}
+        self.pending_chunks = []
+
+    def add(self, points):
+        if not points:
+            return
+        vectors = np.asarray([point.vector for point in points], dtype=np.float32)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        quantized, scales = _quantize(vectors, self.dtype)
+        self.f.write(quantized.tobytes())
+        if scales is not None:
+            self.scales.append(scales)
+        self.count += len(points)
+
+        for point in points:
+            payload = dict(point.payload or {})
+            self.rows["id"].append(point.id)
+            for name in payload_schema:
+                self.rows[name].append(payload.pop(name, None))
+            self.rows["extra"].append(payload)
+            # 行组大小必须固定，读取时按 index // ROW_GROUP_SIZE 定位
+            if len(self.rows["id"]) == ROW_GROUP_SIZE:
+                self._flush_row_group()
+
+    def abort(self):
+        """Close and remove a partially written archive"""
+        self.f.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _flush_row_group(self):
+        if self.rows["id"]:
+            self.pending_chunks.append({name: zlib.compress(json.dumps(values, default=str).encode(), 6)
+                                        for name, values in self.rows.items()})
+            self.rows = {name: [] for name in COLUMNS}
+
+    def close(self, collection_name):
+        self._flush_row_group()
+        vectors_length = self.f.tell() - ALIGNMENT
+
+        scales_offset = self.f.tell()
+        if self.scales:
+            self.f.write(np.concatenate(self.scales).tobytes())
+        scales_length = self.f.tell() - scales_offset
+
+        # 列数据写在向量块之后，按行组记录每块的偏移
+        for row_group in self.pending_chunks:
+            for name, data in row_group.items():
+                self.chunks[name].append([self.f.tell(), len(data)])
+                self.f.write(data)
+
+        footer = json.dumps({
+            "version": ARCHIVE_VERSION,
+            "collection": collection_name,
+            "created_at": datetime.datetime.now().isoformat(),
+            "count": self.count,
+            "dim": self.dim or 0,
+            "dtype": self.dtype,
+            "vectors": [ALIGNMENT, vectors_length],
+            "scales": [scales_offset, scales_length],
+            "row_group_size": ROW_GROUP_SIZE,
+            "columns": self.chunks,
+        }).encode()
+        self.f.write(footer)
+        self.f.write(struct.pack("<Q", len(footer)))
+        self.f.write(MAGIC)
+        self.f.close()
+
+
+class MemoryArchive:
+    """
+    Reader for .orbarchive files
+
+    Vectors are memory-mapped and dequantized block by block; payload columns are
+    decompressed one row group at a time, only when they are needed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"Not a memory archive: {path}")
+            f.seek(-(8 + len(MAGIC)), os.SEEK_END)
+            footer_length = struct.unpack("<Q", f.read(8))[0]
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"Truncated memory archive: {path}")
+            f.seek(-(8 + len(MAGIC) + footer_length), os.SEEK_END)
+            self.meta = json.loads(f.read(footer_length))
+
+        self.count = self.meta["count"]
+        self.dim = self.meta["dim"]
+        self.dtype = self.meta["dtype"]
+        self.row_group_size = self.meta["row_group_size"]
+        self.vectors = np.memmap(path, dtype=self.dtype, mode="r", offset=self.meta["vectors"][0],
+                                 shape=(self.count, self.dim)) if self.count else np.empty((0, self.dim))
+        self.scales = np.memmap(path, dtype=np.float32, mode="r", offset=self.meta["scales"][0],
+                                shape=(self.count,)) if self.dtype == "int8" and self.count else None
+        self._cached_group = (None, None)
+
+    def validate(self):
+        """
+        Check that every block and column chunk is present and decodes, without touching Qdrant
+
+        Raises:
+            ValueError: If the archive cannot be imported as a whole
+        """
+        if self.dtype not in VECTOR_DTYPES:
+            raise ValueError(f"Unsupported vector dtype in archive: {self.dtype}")
+        if self.dim <= 0:
+            raise ValueError("Archive has no vector dimension; re-export it from a collection that still exists")
+        itemsize = np.dtype(self.dtype).itemsize
+        if self.meta["vectors"][1] != self.count * self.dim * itemsize:
+            raise ValueError("Archive vector block does not match its point count")
+        if self.dtype == "int8" and self.meta["scales"][1] != self.count * 4:
+            raise ValueError("Archive scale block does not match its point count")
+
+        groups = -(-self.count // self.row_group_size)
+        for name in COLUMNS:
+            chunks = self.meta["columns"].get(name, [])
+            if len(chunks) != groups:
+                raise ValueError(f"Archive column '{name}' has {len(chunks)} row groups, expected {groups}")
+            for group in range(groups):
+                expected = min(self.row_group_size, self.count - group * self.row_group_size)
+                try:
+                    values = self._column_chunk(name, group)
+                except (OSError, zlib.error, ValueError) as e:
+                    raise ValueError(f"Archive column '{name}' row group {group} is corrupt: {e}") from None
+                if len(values) != expected:
+                    raise ValueError(f"Archive column '{name}' row group {group} has {len(values)} rows, expected {expected}")
+
+    def dequantize(self, start, stop):
+        block = np.asarray(self.vectors[start:stop], dtype=np.float32)
+        if self.scales is not None:
+            block *= self.scales[start:stop, None]
+        return block
+
+    def _column_chunk(self, name, group):
+        offset, length = self.meta["columns"][name][group]
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return json.loads(zlib.decompress(f.read(length)))
+
+    def _row_group(self, group):
+        # 顺序读取时同一行组会被反复访问，缓存最近一个
+        if self._cached_group[0] != group:
+            self._cached_group = (group, {name: self._column_chunk(name, group) for name in COLUMNS})
+        return self._cached_group[1]
+
+    def point(self, index):
+        """Return (id, payload) of one point"""
+        group = self._row_group(index // self.row_group_size)
+        row = index % self.row_group_size
+        payload = dict(group["extra"][row])
+        for name in payload_schema:
+            if group[name][row] is not None:
+                payload[name] = group[name][row]
+        return group["id"][row], payload
+
+    def iter_batches(self, batch_size=256):
+        """Yield (ids, float32 vectors, payloads) without loading the whole archive"""
+        for start in range(0, self.count, batch_size):
+            stop = min(start + batch_size, self.count)
+            points = [self.point(i) for i in range(start, stop)]
+            yield [p[0] for p in points], self.dequantize(start, stop), [p[1] for p in points]
+
+    def search(self, query_vector, limit=10, block_size=65536):
+        """Brute-force cosine search over the memory-mapped vectors; returns [(score, id, payload)]"""
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        best_scores = np.empty(0, dtype=np.float32)
+        best_indexes = np.empty(0, dtype=np.int64)
+        for start in range(0, self.count, block_size):
+            block = self.dequantize(start, min(start + block_size, self.count))
+            norms = np.linalg.norm(block, axis=1)
+            norms[norms == 0] = 1.0
+            scores = np.concatenate([best_scores, (block @ query) / norms])
+            indexes = np.concatenate([best_indexes, np.arange(start, start + len(block))])
+            top = np.argpartition(-scores, min(limit, len(scores)) - 1)[:limit]
+            best_scores, best_indexes = scores[top], indexes[top]
+
+        order = np.argsort(-best_scores)
+        return [(float(best_scores[i]), *self.point(int(best_indexes[i]))) for i in order]
+
+
+def export_memory_archive(user_id="default_user", archive_path=None, dtype="int8"):
+    """
+    Export a user's collection to a compact .orbarchive file
+
+    Args:
+        user_id: User ID to specify which collection to export
+        archive_path: Output path, default is a timestamp-named file in the your_memory directory
+        dtype: Vector encoding, "int8" (with per-vector scales) or "float16"
+
+    Returns:
+        str: Path of the archive, or None on failure
+
+    Raises:
+        ValueError: If dtype is not supported
+    """
+    if dtype not in VECTOR_DTYPES:
+        raise ValueError(f"Unsupported vector dtype: {dtype}, expected one of {', '.join(VECTOR_DTYPES)}")
+    collection_name = get_collection_name(user_id)
+    if archive_path is None:
+        memory_dir = get_memory_dir(user_id)
+        os.makedirs(memory_dir, exist_ok=True)
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        archive_path = os.path.join(memory_dir, f"{collection_name}_archive_{timestamp}{ARCHIVE_SUFFIX}")
+
+    writer = None
+    try:
+        if not qdrant_client.collection_exists(collection_name):
+            logger.warning("Collection '%s' does not exist", collection_name)
+            return None
+
+        # 先写临时文件，完整写完后再改名，避免留下被当作最新导出的残缺归档
+        writer = _ArchiveWriter(f"{archive_path}.tmp", dtype)
+        offset = None
+        while True:
+            with track_call("qdrant", "scroll"):
+                points, offset = qdrant_client.scroll(
+                    collection_name=collection_name,
+                    limit=SCROLL_BATCH,
+                    offset=offset,
+                    with_payload=True,
+                    with_vectors=True
+                )
+            writer.add([point for point in points if isinstance(point.vector, list)])
+            if offset is None:
+                break
+        if writer.dim is None:
+            # 空集合也要记录向量维度，否则导入时无法重建集合
+            with track_call("qdrant", "get_collection"):
+                vectors_config = qdrant_client.get_collection(collection_name).config.params.vectors
+            writer.dim = vectors_config.size
+        writer.close(collection_name)
+        os.replace(writer.path, archive_path)
+
+        logger.info("Archive exported to: %s (%d points, %d bytes)", archive_path, writer.count, os.path.getsize(archive_path))
+        return os.path.abspath(archive_path)
+
+    except Exception as e:
+        logger.exception("Error exporting archive: %s", e)
+        if writer is not None:
+            writer.abort()
+        return None
+
+
+def import_memory_archive(archive_path, user_id="default_user", batch_size=256, workers=4):
+    """
+    Replace a user's collection with the contents of an .orbarchive file
+
+    The archive is validated before the existing collection is dropped, so a corrupt
+    or dimensionless archive leaves the user's data untouched. Batches are upserted
+    in parallel by a thread pool.
+
+    Returns:
+        bool: Whether the import was successful
+
+    Raises:
+        ValueError: If the file is not a valid, importable archive
+    """
+    collection_name = get_collection_name(user_id)
+    # 先完整校验归档（所有列块都能解压），再删除现有集合
+    archive = MemoryArchive(archive_path)
+    archive.validate()
+    try:
+
+        logger.info("Recreating collection '%s' for archive import", collection_name)
+        with track_call("qdrant", "delete_collection"):
+            qdrant_client.delete_collection(collection_name=collection_name)
+        qdrant_client.create_collection(
+            collection_name=collection_name,
+            vectors_config=VectorParams(size=archive.dim, distance=Distance.COSINE)
+        )
+
+        def upsert(batch):
+            ids, vectors, payloads = batch
+            points = [
+                models.PointStruct(id=point_id, vector=vector.tolist(), payload={**payload, "user_id": user_id})
+                for point_id, vector, payload in zip(ids, vectors, payloads)
+            ]
+            with track_call("qdrant", "upsert"):
+                qdrant_client.upsert(collection_name=collection_name, points=points, wait=True)
+            return len(points)
+
+        # 读取与上传流水线执行，在途批次数有上限，避免把整个归档读进内存
+        imported = 0
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for batch in archive.iter_batches(batch_size):
+                if len(in_flight) >= workers * 2:
+                    imported += in_flight.popleft().result()
+                in_flight.append(executor.submit(upsert, batch))
+            while in_flight:
+                imported += in_flight.popleft().result()
+
+        logger.info("Archive imported to collection '%s': %d points", collection_name, imported)
+        bump_generation(user_id)
+        return True
+
+    except Exception as e:
+        logger.exception("Error importing archive: %s", e)
+        return False
@@ -0,0 +1,164 @@
+import os
+import json
+import gzip
+import datetime
+import logging
+from uuid import uuid4
+from qdrant_client.http import models
+from qdrant_client.models import VectorParams, Distance
+from .config import qdrant_client, get_collection_name
+from .memory_store import get_memory_dir, scan_point_digests
+from .memory_version import bump_generation
+from .metrics import track_call
+
+logger = logging.getLogger(__name__)
+
+DELTA_FORMAT = "orb-memory-delta"
+DELTA_VERSION = 1
+BATCH_SIZE = 256
+MANIFEST_KEEP = 10  # 每个用户保留的导出清单数量
+
+
+def _manifest_dir(user_id):
+    return os.path.join(get_memory_dir(user_id), "manifests")
+
+
+def _load_manifest(user_id, token):
+    if not token or os.path.basename(token) != token:
+        return None
+    try:
+        with open(os.path.join(_manifest_dir(user_id), f"{token}.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_manifest(user_id, token, collection_name, digests):
+    manifest_dir = _manifest_dir(user_id)
+    os.makedirs(manifest_dir, exist_ok=True)
+    with open(os.path.join(manifest_dir, f"{token}.json"), "w") as f:
+        json.dump({"collection": collection_name, "points": digests}, f)
+
+    # 只保留最近的清单，更早的导出令牌将失效（需重新全量导出）
+    manifests = sorted(
+        (os.path.getmtime(os.path.join(manifest_dir, name)), name)
+        for name in os.listdir(manifest_dir) if name.endswith(".json")
+    )
+    for _, name in manifests[:-MANIFEST_KEEP]:
+        os.unlink(os.path.join(manifest_dir, name))
+
+
+def export_memory_delta(output_path, user_id="default_user", since=None):
+    """
+    Export only the points added, updated or deleted since a previous export
+
+    Args:
+        output_path: Where to write the gzip-compressed JSON delta
+        user_id: User whose collection is exported
+        since: Export token returned by a previous delta export, None exports everything
+
+    Returns:
+        str: Export token for the next incremental export
+
+    Raises:
+        ValueError: If the collection does not exist or the token is unknown
+    """
+    collection_name = get_collection_name(user_id)
+    if not qdrant_client.collection_exists(collection_name):
+        raise ValueError(f"Collection '{collection_name}' does not exist")
+
+    base = {}
+    if since:
+        manifest = _load_manifest(user_id, since)
+        if manifest is None or manifest.get("collection") != collection_name:
+            raise ValueError(f"Unknown or expired export token: {since}")
+        base = {str(point_id): (point_id, digest) for point_id, digest in manifest["points"]}
+
+    digests = scan_point_digests(collection_name)
+    current_ids = {str(point_id) for point_id, _ in digests}
+    changed = [point_id for point_id, digest in digests if base.get(str(point_id), (None, None))[1] != digest]
+    deleted = [point_id for key, (point_id, _) in base.items() if key not in current_ids]
+
+    # 只为变化的点读取向量和完整载荷
+    upserts = []
+    for start in range(0, len(changed), BATCH_SIZE):
+        with track_call("qdrant", "retrieve"):
+            points = qdrant_client.retrieve(
+                collection_name=collection_name,
+                ids=changed[start:start + BATCH_SIZE],
+                with_payload=True,
+                with_vectors=True
+            )
+        upserts.extend({"id": point.id, "vector": point.vector, "payload": point.payload} for point in points)
+
+    with track_call("qdrant", "get_collection"):
+        vectors_config = qdrant_client.get_collection(collection_name).config.params.vectors
+    token = f"{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid4().hex[:8]}"
+    delta = {
+        "format": DELTA_FORMAT,
+        "version": DELTA_VERSION,
+        "collection": collection_name,
+        "base_token": since,
+        "token": token,
+        "vector_size": getattr(vectors_config, "size", None),
+        "upserts": upserts,
+        "deletes": deleted,
+    }
+    with gzip.open(output_path, "wt", encoding="utf-8") as f:
+        json.dump(delta, f)
+
+    _save_manifest(user_id, token, collection_name, digests)
+    logger.info("Exported delta for '%s': %d upserts, %d deletes", collection_name, len(upserts), len(deleted))
+    return token
+
+
+def import_memory_delta(delta_path, user_id="default_user"):
+    """
+    Apply a delta produced by export_memory_delta to a user's collection
+
+    Points are upserted and deleted in batches; the collection is created if missing
+    but never dropped.
+
+    Returns:
+        bool: Whether the import was successful
+    """
+    collection_name = get_collection_name(user_id)
+    try:
+        with gzip.open(delta_path, "rt", encoding="utf-8") as f:
+            delta = json.load(f)
+        if delta.get("format") != DELTA_FORMAT or delta.get("version") != DELTA_VERSION:
+            logger.warning("Unsupported delta file: %s v%s", delta.get('format'), delta.get('version'))
+            return False
+
+        if not qdrant_client.collection_exists(collection_name):
+            logger.info("Creating collection '%s' for delta import", collection_name)
+            qdrant_client.create_collection(
+                collection_name=collection_name,
+                vectors_config=VectorParams(size=delta["vector_size"], distance=Distance.COSINE)
+            )
+
+        upserts = delta.get("upserts", [])
+        for start in range(0, len(upserts), BATCH_SIZE):
+            points = [
+                models.PointStruct(id=p["id"], vector=p["vector"], payload={**(p["payload"] or {}), "user_id": user_id})
+                for p in upserts[start:start + BATCH_SIZE]
+            ]
+            with track_call("qdrant", "upsert"):
+                qdrant_client.upsert(collection_name=collection_name, points=points, wait=True)
+
+        deletes = delta.get("deletes", [])
+        for start in range(0, len(deletes), BATCH_SIZE):
+            with track_call("qdrant", "delete"):
+                qdrant_client.delete(
+                    collection_name=collection_name,
+                    points_selector=models.PointIdsList(points=deletes[start:start + BATCH_SIZE]),
+                    wait=True
+                )
+
+        logger.info("Applied delta to '%s': %d upserts, %d deletes", collection_name, len(upserts), len(deletes))
+        bump_generation(user_id)
+        return True
+
+    except Exception as e:
+        logger.exception("Error importing delta: %s", e)
+        return False
@@ -1,16 +1,126 @@
 import os
+import json
+import time
+import hashlib
+import logging
 import datetime
+import threading
 import requests
-import traceback
-from .config import config, qdrant_client, get_collection_name
+from .config import config, qdrant_client, get_collection_name, BASE_COLLECTION_NAME
+from .config import MEMORY_EXPORT_DIR, SNAPSHOT_KEEP_COUNT, SNAPSHOT_MAX_AGE, SNAPSHOT_MAX_BYTES, SNAPSHOT_GC_INTERVAL
 from qdrant_client.models import Filter, FieldCondition, MatchValue
 from qdrant_client.http import models
+from .metrics import track_call
+from .memory_version import bump_generation
+from .metrics import SNAPSHOT_EXPORTS, SNAPSHOT_GC_DELETED
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_REGISTRY = "snapshots.json"
+EXPORT_SUFFIXES = (".snapshot", ".orbarchive")  # 本地保留策略管理的导出文件
+_registry_lock = threading.RLock()
+
+# mem0 在内容变化时会更新 hash/updated_at；情景记忆写入后不再修改，只需比较 ID
+DIGEST_FIELDS = ["hash", "updated_at", "created_at"]
+
+
+def get_memory_dir(user_id="default_user"):
+    """Directory holding a user's exported memory files"""
+    return os.path.join(MEMORY_EXPORT_DIR, user_id)
+
+
+def point_digest(payload):
+    data = json.dumps({key: payload.get(key) for key in DIGEST_FIELDS}, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+def scan_point_digests(collection_name):
+    """Return [[point_id, digest], ...] for every point, reading only the digest fields"""
+    digests = []
+    offset = None
+    while True:
+        with track_call("qdrant", "scroll"):
+            points, offset = qdrant_client.scroll(
+                collection_name=collection_name,
+                limit=1000,
+                offset=offset,
+                with_payload=DIGEST_FIELDS,
+                with_vectors=False
+            )
+        digests.extend([point.id, point_digest(point.payload or {})] for point in points)
+        if offset is None:
+            break
+    return digests
+
+
+def get_content_version(user_id, collection_name):
+    """
+    Version of a collection's content, or None if the collection does not exist
+
+    Derived from the IDs and digest fields of the stored points, so writes made by
+    any process (batch runs, the CLI chat, other servers) yield a new version.
+    """
+    with track_call("qdrant", "collection_exists"):
+        if not qdrant_client.collection_exists(collection_name):
+            return None
+    version = hashlib.sha1()
+    for point_id, digest in sorted(scan_point_digests(collection_name), key=lambda item: str(item[0])):
+        version.update(f"{point_id}:{digest}\n".encode())
+    return version.hexdigest()
+
+
+def _registry_path(user_id):
+    return os.path.join(get_memory_dir(user_id), SNAPSHOT_REGISTRY)
+
+
+def _load_registry(user_id):
+    try:
+        with open(_registry_path(user_id)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def _save_registry(user_id, entries):
+    path = _registry_path(user_id)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(entries, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _find_reusable_snapshot(user_id, collection_name, version):
+    """Latest registry entry exported from the same content version"""
+    for entry in reversed(_load_registry(user_id)):
+        if entry.get("collection") == collection_name and entry.get("version") == version:
+            return entry
+    return None
+
+
+def _download_snapshot(collection_name, snapshot_name, output_file):
+    qdrant_host = config["vector_store"]["config"]["host"]
+    qdrant_port = config["vector_store"]["config"]["port"]
+    download_snapshot_url = f"http://{qdrant_host}:{qdrant_port}/collections/{collection_name}/snapshots/{snapshot_name}"
+
+    with track_call("qdrant", "download_snapshot"), requests.get(download_snapshot_url, stream=True) as r:
+        if r.status_code != 200:
+            logger.warning("Failed to download snapshot: %s", r.text)
+            return False
+
+        r.raise_for_status()
+        with open(output_file, 'wb') as f:
+            for chunk in r.iter_content(chunk_size=8192):
+                f.write(chunk)
+    return True
 
 
 def export_qdrant_snapshot(user_id="default_user", collection_name=None, snapshot_path=None):
     """
     Export Qdrant collection to a snapshot file
 
+    If the collection content has not changed since a previous export, the previous
+    local file (or Qdrant-side snapshot) is reused instead of creating a new one.
+
     Args:
         user_id: User ID to specify which collection to export
         collection_name: Name of the collection to export, default is based on user_id
@@ -23,11 +133,13 @@ def export_qdrant_snapshot(user_id="default_user", collection_name=None, snapsho
         collection_name = get_collection_name(user_id)
 
     # 创建保存快照的目录
-    memory_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "your_memory", user_id)
+    memory_dir = get_memory_dir(user_id)
     if not os.path.exists(memory_dir):
-        print(f"Creating directory: {memory_dir}")
+        logger.info("Creating directory: %s", memory_dir)
         os.makedirs(memory_dir)
 
+    # 只有默认路径的导出才登记和复用
+    managed = snapshot_path is None
     if snapshot_path is None:
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
         snapshot_filename = f"{collection_name}_snapshot_{timestamp}"
@@ -35,27 +147,41 @@ def export_qdrant_snapshot(user_id="default_user", collection_name=None, snapsho
 
     try:
         # Check if the collection exists
-        collections = qdrant_client.get_collections()
-        collection_exists = any(col.name == collection_name for col in collections.collections)
-
-        if not collection_exists:
-            print(f"Collection '{collection_name}' does not exist")
+        version = get_content_version(user_id, collection_name)
+        if version is None:
+            logger.warning("Collection '%s' does not exist", collection_name)
             return None
 
+        with _registry_lock:
+            reusable = _find_reusable_snapshot(user_id, collection_name, version) if managed else None
+        if reusable and os.path.exists(reusable["file"]):
+            logger.info("Collection unchanged, reusing snapshot file: %s", reusable['file'])
+            SNAPSHOT_EXPORTS.labels("reused_file").inc()
+            return reusable["file"]
+
+        output_file = f"{snapshot_path}.snapshot"
+        if reusable and reusable.get("qdrant_snapshot"):
+            # 本地文件已被清理，但服务端快照可能还在，直接下载而不重新创建
+            logger.info("Collection unchanged, downloading existing snapshot: %s", reusable['qdrant_snapshot'])
+            if _download_snapshot(collection_name, reusable["qdrant_snapshot"], output_file):
+                SNAPSHOT_EXPORTS.labels("reused_server").inc()
+                _record_snapshot(user_id, collection_name, version, reusable["qdrant_snapshot"], output_file)
+                return os.path.abspath(output_file)
+
         # Step 1: Create snapshot
-        print(f"Creating snapshot for collection '{collection_name}'...")
+        logger.info("Creating snapshot for collection '%s'", collection_name)
         # Use REST API to create snapshot
         qdrant_host = config["vector_store"]["config"]["host"]
         qdrant_port = config["vector_store"]["config"]["port"]
         create_snapshot_url = f"http://{qdrant_host}:{qdrant_port}/collections/{collection_name}/snapshots"
 
-        response = requests.post(create_snapshot_url)
+        with track_call("qdrant", "create_snapshot"):
+            response = requests.post(create_snapshot_url)
         if response.status_code != 200:
-            print(f"Failed to create snapshot: {response.text}")
+            logger.warning("Failed to create snapshot: %s", response.text)
             return None
 
-        # Print full response for debugging
-        print(f"API response: {response.text}")
+        logger.debug("API response: %s", response.text)
         response_data = response.json()
 
         # Try to get snapshot name from response, handle possible different response structures
@@ -66,35 +192,156 @@ def export_qdrant_snapshot(user_id="default_user", collection_name=None, snapsho
         else:
             # If name is not found, use timestamp as name
             snapshot_name = f"snapshot-{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}"
-            print(f"Unable to get snapshot name from response, using temporary name: {snapshot_name}")
+            logger.warning("Unable to get snapshot name from response, using temporary name: %s", snapshot_name)
 
-        print(f"Snapshot created successfully: {snapshot_name}")
+        logger.info("Snapshot created successfully: %s", snapshot_name)
 
         # Step 2: Download snapshot
-        print(f"Downloading snapshot...")
-        download_snapshot_url = f"http://{qdrant_host}:{qdrant_port}/collections/{collection_name}/snapshots/{snapshot_name}"
-
-        with requests.get(download_snapshot_url, stream=True) as r:
-            if r.status_code != 200:
-                print(f"Failed to download snapshot: {r.text}")
-                return None
-
-            r.raise_for_status()
-            output_file = f"{snapshot_path}.snapshot"
-            with open(output_file, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
-
-        full_path = os.path.abspath(f"{snapshot_path}.snapshot")
-        print(f"Snapshot successfully exported to: {full_path}")
+        if not _download_snapshot(collection_name, snapshot_name, output_file):
+            return None
+
+        full_path = os.path.abspath(output_file)
+        SNAPSHOT_EXPORTS.labels("created").inc()
+        if managed:
+            _record_snapshot(user_id, collection_name, version, snapshot_name, full_path)
+        logger.info("Snapshot successfully exported to: %s", full_path)
         return full_path
 
     except Exception as e:
-        print(f"Error exporting snapshot: {str(e)}")
-        traceback.print_exc()  # Print full error stack
+        logger.exception("Error exporting snapshot: %s", e)
         return None
 
 
+def _record_snapshot(user_id, collection_name, version, snapshot_name, path):
+    with _registry_lock:
+        entries = _load_registry(user_id)
+        entries.append({
+            "file": os.path.abspath(path),
+            "collection": collection_name,
+            "version": version,
+            "qdrant_snapshot": snapshot_name,
+            "created_at": time.time(),
+        })
+        _save_registry(user_id, entries)
+    # 导出后立即对该用户的本地文件执行保留策略
+    gc_local_snapshots(user_id)
+
+
+def _select_expired(items, now, keep_latest=False):
+    """
+    Apply the retention policy to (created_at, size, key) items
+
+    Keeps the newest items while they are within SNAPSHOT_KEEP_COUNT, SNAPSHOT_MAX_AGE
+    and SNAPSHOT_MAX_BYTES; returns the keys of everything else.
+    """
+    expired = []
+    kept_bytes = 0
+    for index, (created_at, size, key) in enumerate(sorted(items, key=lambda item: item[0], reverse=True)):
+        if keep_latest and index == 0:
+            kept_bytes += size
+        elif (index >= SNAPSHOT_KEEP_COUNT or now - created_at > SNAPSHOT_MAX_AGE
+                or kept_bytes + size > SNAPSHOT_MAX_BYTES):
+            expired.append(key)
+        else:
+            kept_bytes += size
+    return expired
+
+
+def gc_local_snapshots(user_id):
+    """Delete a user's local snapshot and archive files beyond the retention policy"""
+    memory_dir = get_memory_dir(user_id)
+    if not os.path.isdir(memory_dir):
+        return 0
+
+    items = []
+    for name in os.listdir(memory_dir):
+        path = os.path.join(memory_dir, name)
+        if name.endswith(EXPORT_SUFFIXES) and os.path.isfile(path):
+            stat = os.stat(path)
+            items.append((stat.st_mtime, stat.st_size, os.path.abspath(path)))
+
+    # 最新的文件可能正在被下载，始终保留
+    expired = _select_expired(items, time.time(), keep_latest=True)
+    for path in expired:
+        try:
+            os.unlink(path)
+            logger.info("Deleted expired snapshot file: %s", path)
+        except OSError as e:
+            logger.warning("Failed to delete snapshot file %s: %s", path, e)
+
+    # 登记表只保留本地文件仍在的条目，以及最新一条（其服务端快照可能还能复用）
+    with _registry_lock:
+        entries = _load_registry(user_id)
+        remaining = [e for i, e in enumerate(entries) if i == len(entries) - 1 or os.path.exists(e["file"])]
+        if len(remaining) != len(entries):
+            _save_registry(user_id, remaining)
+    SNAPSHOT_GC_DELETED.labels("local").inc(len(expired))
+    return len(expired)
+
+
+def gc_qdrant_snapshots(collection_name):
+    """Delete Qdrant-side snapshots of a collection beyond the retention policy"""
+    with track_call("qdrant", "list_snapshots"):
+        snapshots = qdrant_client.list_snapshots(collection_name)
+
+    items = []
+    for snapshot in snapshots:
+        created_at = 0
+        if snapshot.creation_time:
+            # Qdrant 返回不带时区的 UTC 时间
+            created = datetime.datetime.fromisoformat(snapshot.creation_time)
+            if created.tzinfo is None:
+                created = created.replace(tzinfo=datetime.timezone.utc)
+            created_at = created.timestamp()
+        items.append((created_at, snapshot.size or 0, snapshot.name))
+
+    expired = _select_expired(items, time.time())
+    for snapshot_name in expired:
+        try:
+            with track_call("qdrant", "delete_snapshot"):
+                qdrant_client.delete_snapshot(collection_name, snapshot_name)
+            logger.info("Deleted expired Qdrant snapshot %s/%s", collection_name, snapshot_name)
+        except Exception as e:
+            logger.warning("Failed to delete Qdrant snapshot %s/%s: %s", collection_name, snapshot_name, e)
+    SNAPSHOT_GC_DELETED.labels("qdrant").inc(len(expired))
+    return len(expired)
+
+
+def gc_snapshots():
+    """Enforce snapshot retention for every user directory and every memory collection"""
+    if os.path.isdir(MEMORY_EXPORT_DIR):
+        for user_id in os.listdir(MEMORY_EXPORT_DIR):
+            if os.path.isdir(os.path.join(MEMORY_EXPORT_DIR, user_id)):
+                gc_local_snapshots(user_id)
+
+    with track_call("qdrant", "get_collections"):
+        collections = qdrant_client.get_collections().collections
+    for collection in collections:
+        if collection.name.startswith(f"{BASE_COLLECTION_NAME}_"):
+            try:
+                gc_qdrant_snapshots(collection.name)
+            except Exception as e:
+                logger.warning("Snapshot GC failed for collection %s: %s", collection.name, e)
+
+
+def start_snapshot_gc(interval=SNAPSHOT_GC_INTERVAL):
+    """Run gc_snapshots in a daemon thread every interval seconds"""
+    if interval <= 0:
+        return None
+
+    def loop():
+        while True:
+            try:
+                gc_snapshots()
+            except Exception as e:
+                logger.exception("Snapshot GC error: %s", e)
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name="snapshot-gc", daemon=True)
+    thread.start()
+    return thread
+
+
 def import_qdrant_snapshot(snapshot_path, user_id="default_user", collection_name=None):
     """
     Import Qdrant collection from a snapshot file
@@ -113,7 +360,7 @@ def import_qdrant_snapshot(snapshot_path, user_id="default_user", collection_nam
     try:
         # Check if the snapshot file exists
         if not os.path.exists(snapshot_path):
-            print(f"Snapshot file does not exist: {snapshot_path}")
+            logger.warning("Snapshot file does not exist: %s", snapshot_path)
             return False
         
         # Configure Qdrant API parameters
@@ -122,18 +369,19 @@ def import_qdrant_snapshot(snapshot_path, user_id="default_user", collection_nam
         
         # Delete existing collection (if exists)
         try:
-            print(f"Deleting existing collection '{collection_name}' (if exists)...")
-            qdrant_client.delete_collection(collection_name=collection_name)
-            print("Collection deleted successfully")
+            logger.info("Deleting existing collection '%s' (if exists)", collection_name)
+            with track_call("qdrant", "delete_collection"):
+                qdrant_client.delete_collection(collection_name=collection_name)
+            logger.debug("Collection deleted successfully")
         except Exception as e:
-            print(f"Exception occurred while deleting collection (possibly collection does not exist): {str(e)}")
+            logger.info("Exception occurred while deleting collection (possibly collection does not exist): %s", e)
         
         # Check file size and format
         file_size = os.path.getsize(snapshot_path)
-        print(f"Snapshot file size: {file_size} bytes")
+        logger.info("Snapshot file size: %d bytes", file_size)
         
         # Restore collection from snapshot file - use upload endpoint
-        print(f"Restoring collection from snapshot file...")
+        logger.info("Restoring collection '%s' from snapshot file", collection_name)
         upload_url = f"http://{qdrant_host}:{qdrant_port}/collections/{collection_name}/snapshots/upload"
                 
         # api_key = config["vector_store"]["config"]["api_key"]
@@ -141,32 +389,31 @@ def import_qdrant_snapshot(snapshot_path, user_id="default_user", collection_nam
         #     "api-key": api_key
         # }
         # Open file in binary mode and set up request correctly
-        with open(snapshot_path, 'rb') as f:
+        with open(snapshot_path, 'rb') as f, track_call("qdrant", "upload_snapshot"):
             files = {'snapshot': (os.path.basename(snapshot_path), f)}
             response = requests.post(upload_url, files=files)
         
-        # Print detailed response information for debugging
-        print(f"Response status code: {response.status_code}")
-        print(f"Response content: {response.text}")
+        logger.debug("Response status code: %s, content: %s", response.status_code, response.text)
         
         if response.status_code != 200:
-            print(f"Failed to restore from snapshot: {response.text}")
+            logger.warning("Failed to restore from snapshot: %s", response.text)
             return False
         
-        print(f"Snapshot successfully imported to collection '{collection_name}'")
+        logger.info("Snapshot successfully imported to collection '%s'", collection_name)
         
-        print(f"开始替换用户ID为 {user_id}...")
+        logger.info("开始替换用户ID为 %s", user_id)
         update_success = update_user_id_in_collection(collection_name, user_id)
         if not update_success:
-            print("用户ID替换失败")
+            logger.warning("用户ID替换失败")
             qdrant_client.delete_collection(collection_name)  # 清理失败数据
+            bump_generation(user_id)
             return False
         
+        bump_generation(user_id)
         return True
         
     except Exception as e:
-        print(f"Error importing snapshot: {str(e)}")
-        traceback.print_exc()  # Print full stack for debugging
+        logger.exception("Error importing snapshot: %s", e)
         return False
     
 # update current user_id
@@ -188,14 +435,15 @@ def update_user_id_in_collection(collection_name, target_user_id):
         
         while True:
             # 获取数据（适配版本）
-            scroll_response = qdrant_client.scroll(
-                collection_name=collection_name,
-                scroll_filter=old_user_filter,
-                limit=100,
-                offset=current_offset,
-                with_payload=True,
-                with_vectors=True  # 明确要求返回向量
-            )
+            with track_call("qdrant", "scroll"):
+                scroll_response = qdrant_client.scroll(
+                    collection_name=collection_name,
+                    scroll_filter=old_user_filter,
+                    limit=100,
+                    offset=current_offset,
+                    with_payload=True,
+                    with_vectors=True  # 明确要求返回向量
+                )
             
             # 解析响应
             if isinstance(scroll_response, tuple):
@@ -224,7 +472,7 @@ def update_user_id_in_collection(collection_name, target_user_id):
                 
             # 类型校验
             if not isinstance(point.vector, (list, dict)):
-                print(f"非法向量类型 ({type(point.vector)}) 在点 {point.id}")
+                logger.warning("非法向量类型 (%s) 在点 %s", type(point.vector), point.id)
                 skipped_points += 1
                 continue
                 
@@ -239,18 +487,42 @@ def update_user_id_in_collection(collection_name, target_user_id):
         
         # 执行更新
         if update_points:
-            qdrant_client.upsert(
-                collection_name=collection_name,
-                points=update_points,
-                wait=True
-            )
-            print(f"成功更新 {len(update_points)} 个点，跳过 {skipped_points} 个无效点")
+            with track_call("qdrant", "upsert"):
+                qdrant_client.upsert(
+                    collection_name=collection_name,
+                    points=update_points,
+                    wait=True
+                )
+            logger.info("成功更新 %d 个点，跳过 %d 个无效点", len(update_points), skipped_points)
             return True
         else:
-            print("没有有效点需要更新")
+            logger.warning("没有有效点需要更新")
             return False
             
     except Exception as e:
-        print(f"用户ID替换失败: {str(e)}")
-        traceback.print_exc()
-        return False
\ No newline at end of file
+        logger.exception("用户ID替换失败: %s", e)
+        return False
+
+def search_memory_candidates(query_vector, user_id="default_user", limit=50, search_params=None):
+    """
+    Vector search over a user's mem0 memories, returning points with their vectors
+
+    Args:
+        query_vector: Query embedding
+        user_id: User whose collection and memories are searched
+        limit: Number of candidates to fetch
+        search_params: Optional Qdrant SearchParams (hnsw_ef, exact, quantization rescoring)
+
+    Returns:
+        list: Scored points including payload and vector
+    """
+    with track_call("qdrant", "search"):
+        return qdrant_client.search(
+            collection_name=get_collection_name(user_id),
+            query_vector=query_vector,
+            query_filter=Filter(must=[FieldCondition(key="user_id", match=MatchValue(value=user_id))]),
+            limit=limit,
+            search_params=search_params,
+            with_payload=True,
+            with_vectors=True
+        )
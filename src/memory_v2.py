@@ -1,12 +1,21 @@
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
 from .config import get_user_memory, openai_client, llm, global_memory, get_collection_name, init_user_collection
-from .config import config, qdrant_client, embedder_info
+from .config import config, qdrant_client, embedder_info, MMR_LAMBDA, EPISODIC_TOKEN_BUDGET, OLLAMA_URL, OLLAMA_KEEP_ALIVE
+from .rerank import mmr_rerank, pack_by_token_budget, hybrid_merge
+from .search_params import resolve_search_params, qdrant_search_params
+import numpy as np
 from uuid import uuid4
 from qdrant_client.models import PointStruct, Filter, FieldCondition, MatchText
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 import requests
+import logging
 from typing import List
+from .metrics import track_call, timed_call
+from .memory_version import bump_generation
+from .singleflight import singleflight
+
+logger = logging.getLogger(__name__)
 
 def creat_reflection_prompt():
     reflection_prompt_template = """
@@ -93,11 +102,13 @@ def format_conversation(messages):
     # Join with newlines
     return "\n".join(conversation)
 
+@singleflight("ollama_embeddings")
+@timed_call("ollama", "embeddings")
 def embed_text(text: str) -> List[float]:
     """使用 Ollama 生成向量（保持与原始配置相同）"""
     response = requests.post(
-        "http://localhost:11434/api/embeddings",  # 使用 HTTP 协议
-        json={"model": "nomic-embed-text", "text": text}
+        f"{OLLAMA_URL}/api/embeddings",  # 使用 HTTP 协议
+        json={"model": "nomic-embed-text", "text": text, "keep_alive": OLLAMA_KEEP_ALIVE}
     )
     if response.status_code != 200:
         raise Exception(f"Ollama API 请求失败: {response.text}")
@@ -107,16 +118,17 @@ def embed_text(text: str) -> List[float]:
 def add_episodic_memory(messages, user_id="default_user"):
     # 初始化用户集合
     collection_name = get_collection_name(user_id)
-    if not qdrant_client.collection_exists(collection_name):
+    with track_call("qdrant", "collection_exists"):
+        exists = qdrant_client.collection_exists(collection_name)
+    if not exists:
         init_user_collection(user_id)  # 确保调用初始化
-        print("/n 初始化")
-    else:
-        print("/n 已初始化")
+        logger.info("Initialized episodic collection '%s'", collection_name)
 
     # 生成嵌入向量
     conversation = format_conversation(messages)
-    reflection = creat_reflection_prompt().invoke({"conversation": conversation})
-    print("/n",reflection)
+    with track_call("openai", "reflection"):
+        reflection = creat_reflection_prompt().invoke({"conversation": conversation})
+    logger.debug("Episodic reflection: %s", reflection)
     
     summary = reflection.get('conversation_summary', "")
     embedding = embed_text([summary])[0]
@@ -135,72 +147,89 @@ def add_episodic_memory(messages, user_id="default_user"):
     )
 
     # 批量插入
-    qdrant_client.upsert(
-        collection_name=collection_name,
-        points=[point]
-    )
+    with track_call("qdrant", "upsert"):
+        qdrant_client.upsert(
+            collection_name=collection_name,
+            points=[point]
+        )
+    bump_generation(user_id)
 
 
-def episodic_recall(query: str, user_id: str = "default_user", alpha=0.5):
+def episodic_recall(query: str, user_id: str = "default_user", search=None, vector=None):
+    """
+    Hybrid (vector + keyword) recall of episodic memories, diversified with MMR
+
+    Args:
+        query: Query text
+        user_id: User whose episodic memories are searched
+        search: Optional per-request overrides of the "episodic" search parameters
+        vector: Precomputed query embedding, embedded from query if None
+    """
+    params = resolve_search_params("episodic", search)
     collection_name = get_collection_name(user_id)
     
     # 生成双路查询条件
-    vector = embedder_info.embed_query(query)
+    if vector is None:
+        vector = embed_episodic_query(query)
     bm25_filter = Filter(
         must=[FieldCondition(key="conversation", match=MatchText(text=query))]
     )
 
     # 混合检索实现
-    vector_results = qdrant_client.search(
-        collection_name=collection_name,
-        query_vector=vector,
-        limit=5
-    )
+    with track_call("qdrant", "search"):
+        vector_results = qdrant_client.search(
+            collection_name=collection_name,
+            query_vector=vector,
+            limit=params["limit"],
+            search_params=qdrant_search_params(params),
+            with_vectors=True
+        )
     
-    keyword_results = qdrant_client.scroll(
-        collection_name=collection_name,
-        scroll_filter=bm25_filter,
-        limit=5
-    )
+    with track_call("qdrant", "scroll"):
+        keyword_results, _ = qdrant_client.scroll(
+            collection_name=collection_name,
+            scroll_filter=bm25_filter,
+            limit=params["limit"],
+            with_vectors=True
+        )
+
+    # 用户集合中也存有 mem0 的对话记忆，只保留情景记忆
+    vector_results = [item for item in vector_results if "conversation_summary" in (item.payload or {})]
 
     # 结果融合算法
     combined = hybrid_merge(
         vector_results, 
         keyword_results,
-        alpha=alpha
+        alpha=params["alpha"]
     )
-    return combined[:3]  # 返回Top3结果
+    # MMR 去冗余：以融合排序作为相关性，避免相似的情景记忆挤占提示词
+    top_k = params["top_k"]
+    combined = [item for item in combined if item.vector is not None]
+    if len(combined) <= top_k:
+        return combined
+    relevance = np.linspace(1.0, 0.0, len(combined), endpoint=False)
+    order = mmr_rerank(vector, [item.vector for item in combined], top_k, MMR_LAMBDA, relevance=relevance)
+    return [combined[i] for i in order]  # 返回TopK结果
 
-def hybrid_merge(vector_res, keyword_res, alpha):
-    # 实现得分加权融合算法
-    scores = {}
-    for idx, item in enumerate(vector_res):
-        scores[item.id] = alpha * (1 - item.score)  # Qdrant返回余弦相似度得分
-    
-    for idx, item in enumerate(keyword_res):
-        bm25_score = (idx + 1) / len(keyword_res)  # 简化的BM25得分估算
-        if item.id in scores:
-            scores[item.id] += (1 - alpha) * bm25_score
-        else:
-            scores[item.id] = (1 - alpha) * bm25_score
-    
-    # 合并去重并排序
-    all_items = {item.id: item for item in vector_res + keyword_res}
-    sorted_items = sorted(
-        all_items.values(),
-        key=lambda x: scores.get(x.id, 0),
-        reverse=True
-    )
-    return sorted_items
+
+def embed_episodic_query(query: str):
+    with track_call("openai", "embed_query"):
+        return embedder_info.embed_query(query)
 
 
-def episodic_system_prompt(query: str, user_id: str):
-    memories = episodic_recall(query, user_id)
+def episodic_system_prompt(query: str, user_id: str, search=None, vector=None):
+    memories = episodic_recall(query, user_id, search, vector)
     if not memories:
         return SystemMessage(content="You are a helpful AI Assistant.")
-    
+    return render_episodic_prompt(memories)
+
+
+def render_episodic_prompt(memories):
+    """Render recalled episodic memories (most relevant first) into a SystemMessage"""
     current_memory = memories[0].payload
-    previous_convos = [m.payload["conversation_summary"] for m in memories[1:4]]
+    previous_convos = pack_by_token_budget(
+        [m.payload["conversation_summary"] for m in memories[1:4]], EPISODIC_TOKEN_BUDGET, separator=" | "
+    )
     
     prompt_template = f"""
     You are a helpful AI Assistant with conversation memory:
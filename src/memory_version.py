@@ -0,0 +1,32 @@
+import threading
+
+# 每个用户记忆集合的版本号，任何写入（对话记忆、情景记忆、导入、删除）都会递增
+_lock = threading.Lock()
+_generations = {}
+_listeners = []
+
+
+def get_generation(user_id):
+    return _generations.get(user_id, 0)
+
+
+def bump_generation(user_id):
+    """Mark the user's memory set as changed and notify listeners"""
+    with _lock:
+        generation = _generations.get(user_id, 0) + 1
+        _generations[user_id] = generation
+    for listener in list(_listeners):
+        listener(user_id, generation)
+    return generation
+
+
+def on_memory_change(listener):
+    """Register listener(user_id, generation), called after every bump"""
+    _listeners.append(listener)
+    return listener
+
+
+def memory_changed(add_result):
+    """Whether a mem0 Memory.add result reports any ADD/UPDATE/DELETE event"""
+    results = add_result.get("results", []) if isinstance(add_result, dict) else (add_result or [])
+    return any(item.get("event", "ADD") != "NONE" for item in results if isinstance(item, dict))
@@ -0,0 +1,165 @@
+import time
+from contextlib import contextmanager
+from functools import wraps
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+
+# 外部依赖调用耗时 buckets（秒），覆盖 Ollama 嵌入到 LLM 全量生成
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+EXTERNAL_CALL_SECONDS = Histogram(
+    "orb_external_call_seconds",
+    "Latency of calls to external dependencies (qdrant, ollama, openai, mem0, playwright)",
+    ["service", "operation"],
+    buckets=LATENCY_BUCKETS,
+)
+EXTERNAL_CALL_ERRORS = Counter(
+    "orb_external_call_errors_total",
+    "Failed calls to external dependencies",
+    ["service", "operation"],
+)
+STAGE_SECONDS = Histogram(
+    "orb_request_stage_seconds",
+    "Latency of individual stages inside a request",
+    ["route", "stage"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_REQUESTS = Counter(
+    "orb_http_requests_total",
+    "HTTP requests handled",
+    ["route", "method", "status"],
+)
+INFLIGHT_STREAMS = Gauge(
+    "orb_inflight_streams",
+    "SSE streams currently being generated",
+    ["route"],
+)
+ADMISSION_QUEUE_WAIT_SECONDS = Histogram(
+    "orb_admission_queue_wait_seconds",
+    "Time admitted requests spent waiting for a concurrency slot",
+    ["pool"],
+    buckets=LATENCY_BUCKETS,
+)
+ADMISSION_REJECTED = Counter(
+    "orb_admission_rejected_total",
+    "Requests shed by admission control",
+    ["pool", "reason"],
+)
+ADMISSION_ACTIVE = Gauge(
+    "orb_admission_active",
+    "Requests currently holding an admission slot",
+    ["pool"],
+)
+SNAPSHOT_EXPORTS = Counter(
+    "orb_snapshot_exports_total",
+    "Memory snapshot exports by outcome (created, reused_file, reused_server)",
+    ["result"],
+)
+SNAPSHOT_GC_DELETED = Counter(
+    "orb_snapshot_gc_deleted_total",
+    "Snapshots deleted by retention GC",
+    ["location"],
+)
+SINGLEFLIGHT_CALLS = Counter(
+    "orb_singleflight_calls_total",
+    "Calls through single-flight groups; result=shared means the call was coalesced",
+    ["group", "result"],
+)
+SINGLEFLIGHT_INFLIGHT = Gauge(
+    "orb_singleflight_inflight",
+    "Distinct backend calls currently in flight per single-flight group",
+    ["group"],
+)
+SSE_RESUMES = Counter(
+    "orb_sse_resumes_total",
+    "SSE streams resumed from the replay buffer via Last-Event-ID",
+)
+RESPONSE_CACHE_LOOKUPS = Counter(
+    "orb_response_cache_lookups_total",
+    "Semantic response cache lookups",
+    ["result"],
+)
+RETRIEVAL_DEGRADED = Counter(
+    "orb_retrieval_degraded_total",
+    "Responses generated with fallback memories because retrieval timed out or failed",
+    ["route", "reason"],
+)
+EPISODIC_PROMPT_REFRESHES = Counter(
+    "orb_episodic_prompt_refreshes_total",
+    "Background rebuilds of cached episodic system prompts",
+    ["reason", "result"],
+)
+WARMUP_SECONDS = Gauge(
+    "orb_warmup_seconds",
+    "Duration of each startup warm-up step",
+    ["step"],
+)
+LOG_RECORDS_DROPPED = Counter(
+    "orb_log_records_dropped_total",
+    "Log records dropped because the log queue was full",
+)
+QUEUE_DEPTH = Gauge(
+    "orb_queue_depth",
+    "Number of items waiting in internal queues",
+    ["queue"],
+)
+
+
+@contextmanager
+def track_call(service, operation):
+    """Time a call to an external dependency and count failures"""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        EXTERNAL_CALL_ERRORS.labels(service, operation).inc()
+        raise
+    finally:
+        EXTERNAL_CALL_SECONDS.labels(service, operation).observe(time.perf_counter() - start)
+
+
+def timed_call(service, operation):
+    """Decorator form of track_call"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with track_call(service, operation):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def track_stage(route, stage, timings=None):
+    """Time one stage of a request (retrieval, ttft, streaming, ...), optionally recording it into timings"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(route, stage, time.perf_counter() - start, timings)
+
+
+def observe_stage(route, stage, seconds, timings=None):
+    STAGE_SECONDS.labels(route, stage).observe(seconds)
+    if timings is not None:
+        timings[stage] = round(seconds, 4)
+
+
+@contextmanager
+def track_stream(route):
+    """Count a stream as in flight for as long as the block runs"""
+    gauge = INFLIGHT_STREAMS.labels(route)
+    gauge.inc()
+    try:
+        yield
+    finally:
+        gauge.dec()
+
+
+def register_queue(name, size_fn):
+    """Report the current size of an internal queue at scrape time"""
+    QUEUE_DEPTH.labels(name).set_function(size_fn)
+
+
+def render_metrics():
+    """Return the Prometheus text exposition and its content type"""
+    return generate_latest(), CONTENT_TYPE_LATEST
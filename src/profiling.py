@@ -0,0 +1,145 @@
+import os
+import sys
+import time
+import random
+import logging
+import threading
+from collections import Counter
+from contextvars import ContextVar
+from .config import PROFILING_ENABLED, PROFILE_SAMPLE_RATE, PROFILE_TOKEN, PROFILE_INTERVAL, PROFILE_DIR, PROFILE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+# 当前请求的采样器，复制上下文的后台线程（SSE 生成、检索线程池）据此把自己加入采样
+_active_profiler: ContextVar = ContextVar("orb_profiler", default=None)
+
+
+def set_active_profiler(profiler):
+    """Make profiler (or None) the one threads copying the current context report to"""
+    _active_profiler.set(profiler)
+
+
+def current_profiler():
+    return _active_profiler.get()
+
+
+def _fold_stack(frame):
+    """Render a frame chain as a collapsed stack line (root first, ';' separated)"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(names)
+
+
+class SamplingProfiler:
+    """
+    Periodically samples the stacks of the threads serving one request.
+
+    Samples are aggregated as collapsed stacks, the format consumed by
+    flamegraph.pl, speedscope and inferno.
+    """
+
+    def __init__(self, endpoint, interval=PROFILE_INTERVAL):
+        self.endpoint = endpoint
+        self.interval = interval
+        self.thread_ids = {threading.get_ident()}
+        self.stacks = Counter()
+        self.started_at = time.time()
+        self._stop_event = threading.Event()
+        self._stopped = False
+        self._sampler = threading.Thread(target=self._run, name=f"profiler-{endpoint}", daemon=True)
+
+    def add_thread(self, thread_id=None):
+        """Also sample another thread working on behalf of this request"""
+        self.thread_ids.add(thread_id or threading.get_ident())
+
+    def remove_thread(self, thread_id=None):
+        """Stop sampling a pooled thread once it is done with this request"""
+        self.thread_ids.discard(thread_id or threading.get_ident())
+
+    def start(self):
+        self._sampler.start()
+        return self
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in tuple(self.thread_ids):
+                frame = frames.get(thread_id)
+                if frame is not None and thread_id != own_id:
+                    self.stacks[_fold_stack(frame)] += 1
+
+    def stop(self):
+        """Stop sampling and write the collapsed stacks; returns the output path"""
+        if self._stopped:
+            return None
+        self._stopped = True
+        self._stop_event.set()
+        self._sampler.join(timeout=1)
+        if not self.stacks:
+            return None
+        try:
+            return write_profile(self.endpoint, self.stacks, self.started_at)
+        except Exception as e:
+            logger.exception("Failed to write profile: %s", e)
+            return None
+
+
+def write_profile(endpoint, stacks, started_at):
+    endpoint_dir = os.path.join(PROFILE_DIR, endpoint)
+    os.makedirs(endpoint_dir, exist_ok=True)
+
+    timestamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(started_at))
+    path = os.path.join(endpoint_dir, f"{timestamp}_{os.getpid()}_{random.randrange(16 ** 6):06x}.folded")
+    with open(path, "w") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+
+    rotate_profiles(endpoint_dir)
+    return path
+
+
+def rotate_profiles(endpoint_dir, max_bytes=PROFILE_MAX_BYTES):
+    """Delete the oldest profiles until the directory fits in max_bytes"""
+    entries = []
+    for name in os.listdir(endpoint_dir):
+        path = os.path.join(endpoint_dir, name)
+        if name.endswith(".folded") and os.path.isfile(path):
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.unlink(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def _requested(req):
+    flag = req.headers.get("X-Orb-Profile") or req.args.get("profile")
+    if not flag:
+        return False
+    if PROFILE_TOKEN:
+        return flag == PROFILE_TOKEN
+    return flag.lower() in ("1", "true", "yes")
+
+
+def start_request_profiler(req):
+    """
+    Start a profiler for the current Flask request if it asked for one or was sampled.
+
+    Returns None (and does no work beyond one flag check) when profiling is disabled.
+    """
+    if not PROFILING_ENABLED:
+        return None
+    if not (_requested(req) or (PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE)):
+        return None
+    return SamplingProfiler(req.endpoint or "unmatched").start()
@@ -0,0 +1,198 @@
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import threading
+import contextvars
+import traceback
+from uuid import uuid4
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .config import qdrant_client, get_collection_name, global_memory, evict_user_memory, PURGE_WORKERS, PURGE_WORKERS_MAX
+from .memory_store import get_memory_dir
+from .memory_version import bump_generation
+from .retrieval import last_memories
+from .episodic_cache import episodic_prompts
+from .metrics import track_call
+from .logging_setup import set_log_context
+
+logger = logging.getLogger(__name__)
+
+MAX_JOBS = 100  # 内存中保留的任务记录数
+
+
+def _validate_user_id(user_id):
+    # user_id 会拼进本地目录路径，禁止路径穿越
+    if not isinstance(user_id, str) or user_id in ("", ".", "..") or os.path.basename(user_id) != user_id:
+        raise ValueError(f"Invalid user_id: {user_id!r}")
+
+
+def purge_user(user_id):
+    """
+    Delete everything stored for a user; safe to call again for an already purged user
+
+    Removes the Qdrant collection (mem0 memories and episodic points) and its
+    server-side snapshots, the working memory session, local snapshot/archive files
+    and cached state.
+
+    Returns:
+        dict: What was found and removed
+    """
+    _validate_user_id(user_id)
+    collection_name = get_collection_name(user_id)
+
+    # 服务端快照保存着集合的完整副本，且集合删除后快照 GC 不会再处理它们，必须先删除
+    snapshots_deleted = 0
+    with track_call("qdrant", "collection_exists"):
+        exists = qdrant_client.collection_exists(collection_name)
+    if exists:
+        with track_call("qdrant", "list_snapshots"):
+            snapshots = qdrant_client.list_snapshots(collection_name)
+        for snapshot in snapshots:
+            with track_call("qdrant", "delete_snapshot"):
+                qdrant_client.delete_snapshot(collection_name, snapshot.name)
+            snapshots_deleted += 1
+
+    with track_call("qdrant", "delete_collection"):
+        collection_deleted = bool(qdrant_client.delete_collection(collection_name=collection_name))
+
+    session_deleted = global_memory.pop(user_id, None) is not None
+    evict_user_memory(user_id)
+    last_memories.invalidate(user_id)
+    episodic_prompts.forget(user_id)
+
+    memory_dir = get_memory_dir(user_id)
+    files_deleted = os.path.isdir(memory_dir)
+    shutil.rmtree(memory_dir, ignore_errors=True)
+
+    # 通知缓存等监听方，用户的记忆已变化
+    bump_generation(user_id)
+
+    return {
+        "collection_deleted": collection_deleted,
+        "snapshots_deleted": snapshots_deleted,
+        "session_deleted": session_deleted,
+        "files_deleted": files_deleted,
+    }
+
+
+def _purge_logged(user_id):
+    set_log_context(user_id=user_id)
+    return purge_user(user_id)
+
+
+class PurgeJob:
+    """Purges many users with bounded parallelism and tracks progress"""
+
+    def __init__(self, user_ids, workers=PURGE_WORKERS):
+        self.id = uuid4().hex
+        self.user_ids = list(dict.fromkeys(user_ids))  # 去重并保持顺序
+        self.workers = min(max(1, workers), PURGE_WORKERS_MAX)
+        self.completed = 0
+        self.failed = {}
+        self.status = "pending"
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def run(self, on_progress=None):
+        self.status = "running"
+        self.started_at = time.time()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            # 每个任务各用一份上下文副本：沿用发起方的日志上下文并附上各自的 user_id
+            futures = {executor.submit(contextvars.copy_context().run, _purge_logged, user_id): user_id
+                       for user_id in self.user_ids}
+            for future in as_completed(futures):
+                user_id = futures[future]
+                with self._lock:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        logger.error("Failed to purge %s", user_id, exc_info=e)
+                        self.failed[user_id] = str(e)
+                    self.completed += 1
+                if on_progress:
+                    on_progress(self)
+        self.finished_at = time.time()
+        self.status = "completed" if not self.failed else "completed_with_errors"
+        logger.info("Purge job %s %s: %d users, %d failed in %.1fs", self.id, self.status,
+                    len(self.user_ids), len(self.failed), self.finished_at - self.started_at)
+        return self
+
+    def start(self):
+        context = contextvars.copy_context()  # 沿用发起请求的日志上下文
+        thread = threading.Thread(target=context.run, args=(self.run,), name=f"purge-{self.id[:8]}", daemon=True)
+        thread.start()
+        return self
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "status": self.status,
+                "total": len(self.user_ids),
+                "completed": self.completed,
+                "failed": dict(self.failed),
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def start_purge_job(user_ids, workers=PURGE_WORKERS):
+    """Validate user IDs and purge them in the background; returns the job"""
+    for user_id in user_ids:
+        _validate_user_id(user_id)
+    job = PurgeJob(user_ids, workers)
+    with _jobs_lock:
+        _jobs[job.id] = job
+        while len(_jobs) > MAX_JOBS:
+            del _jobs[next(iter(_jobs))]
+    return job.start()
+
+
+def get_purge_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def main():
+    """Command line entry point: python -m src.purge user1 user2 --file ids.txt"""
+    parser = argparse.ArgumentParser(description='Purge all stored data for many users')
+    parser.add_argument('user_ids', nargs='*', help='User IDs to purge')
+    parser.add_argument('--file', help='File with one user ID per line')
+    parser.add_argument('--workers', type=int, default=PURGE_WORKERS, help='Number of users purged in parallel')
+    args = parser.parse_args()
+
+    user_ids = list(args.user_ids)
+    if args.file:
+        with open(args.file) as f:
+            user_ids.extend(line.strip() for line in f if line.strip())
+    if not user_ids:
+        parser.error("no user IDs given")
+    for user_id in user_ids:
+        _validate_user_id(user_id)
+
+    def report(job):
+        print(f"\rPurged {job.completed}/{len(job.user_ids)} users, {len(job.failed)} failed", end="", flush=True)
+
+    job = PurgeJob(user_ids, args.workers).run(on_progress=report)
+    print()
+    for user_id, error in job.failed.items():
+        print(f"Failed to purge {user_id}: {error}")
+    sys.exit(1 if job.failed else 0)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except ValueError as e:
+        print(str(e))
+        sys.exit(2)
+    except Exception:
+        traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,120 @@
+from functools import lru_cache
+import numpy as np
+
+
+def mmr_rerank(query_vector, candidate_vectors, k, lambda_mult=0.5, relevance=None):
+    """
+    Pick k candidates by maximal marginal relevance.
+
+    Args:
+        query_vector: Query embedding
+        candidate_vectors: (n, d) candidate embeddings
+        k: Number of candidates to select
+        lambda_mult: 1.0 ranks purely by relevance, 0.0 purely by diversity
+        relevance: Optional precomputed relevance scores, defaults to cosine similarity with the query
+
+    Returns:
+        list[int]: Indices of the selected candidates in selection order
+    """
+    candidates = np.asarray(candidate_vectors, dtype=np.float32)
+    n = len(candidates)
+    if n == 0 or k <= 0:
+        return []
+    k = min(k, n)
+
+    candidates = candidates.reshape(n, -1)
+    # 不归一化整个矩阵（会复制 n*d 数据），只计算范数并在点积后相除
+    norms = np.sqrt(np.einsum("ij,ij->i", candidates, candidates))
+    norms[norms == 0] = 1.0
+    if relevance is None:
+        query = np.asarray(query_vector, dtype=np.float32)
+        relevance = (candidates @ query) / (norms * (np.linalg.norm(query) or 1.0))
+    else:
+        relevance = np.asarray(relevance, dtype=np.float32)
+
+    # 维护每个候选与已选集合的最大相似度，每轮只需一次矩阵-向量乘法
+    max_similarity = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    selected = [int(np.argmax(relevance))]
+    available[selected[0]] = False
+
+    while len(selected) < k:
+        last = selected[-1]
+        similarity = (candidates @ candidates[last]) / (norms * norms[last])
+        np.maximum(max_similarity, similarity, out=max_similarity)
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        index = int(np.argmax(scores))
+        selected.append(index)
+        available[index] = False
+
+    return selected
+
+
+@lru_cache(maxsize=1)
+def _encoder():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("o200k_base")  # gpt-4o 系列使用的编码
+    except Exception:
+        return None
+
+
+def count_tokens(text):
+    encoder = _encoder()
+    if encoder is None:
+        return len(text) // 4 + 1  # 粗略估算：约 4 个字符一个 token
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+def pack_by_token_budget(texts, token_budget, separator="\n"):
+    """
+    Keep texts in order while their total token count fits in token_budget.
+
+    A text that does not fit is skipped so shorter ones after it can still be used.
+    """
+    separator_tokens = count_tokens(separator) if separator else 0
+    packed = []
+    used = 0
+    for text in texts:
+        cost = count_tokens(text) + (separator_tokens if packed else 0)
+        if used + cost > token_budget:
+            continue
+        packed.append(text)
+        used += cost
+    return packed
+
+
+def select_memories(query_vector, hits, k, token_budget, lambda_mult=0.5, text_key="data"):
+    """
+    Diversify Qdrant hits (returned with vectors) with MMR and pack their texts into a token budget.
+
+    Returns:
+        list[str]: Memory texts, most relevant first
+    """
+    hits = [hit for hit in hits if hit.vector is not None and hit.payload.get(text_key)]
+    if not hits:
+        return []
+    order = mmr_rerank(query_vector, [hit.vector for hit in hits], k, lambda_mult)
+    return pack_by_token_budget([f"- {hits[i].payload[text_key]}" for i in order], token_budget)
+
+
+def hybrid_merge(vector_res, keyword_res, alpha):
+    """
+    Fuse vector and keyword results by weighted score; alpha weights the vector leg
+
+    Vector hits contribute their cosine similarity; keyword hits, which have no
+    score, contribute 1.0 for the first result down to 1/len for the last.
+    """
+    # 实现得分加权融合算法
+    scores = {}
+    for item in vector_res:
+        scores[item.id] = alpha * item.score  # Qdrant返回余弦相似度得分，越大越相关
+
+    for idx, item in enumerate(keyword_res):
+        bm25_score = 1 - idx / len(keyword_res)  # 简化的BM25得分估算：按排名线性衰减
+        scores[item.id] = scores.get(item.id, 0) + (1 - alpha) * bm25_score
+
+    # 合并去重并排序
+    all_items = {item.id: item for item in vector_res + keyword_res}
+    return sorted(all_items.values(), key=lambda x: scores.get(x.id, 0), reverse=True)
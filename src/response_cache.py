@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import OrderedDict
+from itertools import count
+import numpy as np
+from .config import RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_THRESHOLD, RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_ENTRIES
+from .memory_version import on_memory_change
+from .metrics import RESPONSE_CACHE_LOOKUPS
+
+
+class _Entry:
+    __slots__ = ("user_id", "vector", "generation", "chunks", "created_at")
+
+    def __init__(self, user_id, vector, generation, chunks):
+        self.user_id = user_id
+        self.vector = vector
+        self.generation = generation
+        self.chunks = chunks
+        self.created_at = time.monotonic()
+
+
+def _normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticResponseCache:
+    """
+    Caches streamed answers per user, keyed by query embedding and memory generation.
+
+    A lookup hits when a live entry for the same user and generation has cosine
+    similarity >= threshold with the query. Entries expire after ttl seconds and the
+    least recently used ones are evicted beyond max_entries.
+    """
+
+    def __init__(self, enabled, threshold, ttl, max_entries):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # entry_id -> _Entry，按最近使用排序
+        self._by_user = {}  # user_id -> set(entry_id)
+        self._ids = count()
+
+    def lookup(self, user_id, vector, generation):
+        """Return the cached chunks for the closest matching query, or None"""
+        query = _normalize(vector)
+        now = time.monotonic()
+        with self._lock:
+            candidates = []
+            for entry_id in list(self._by_user.get(user_id, ())):
+                entry = self._entries[entry_id]
+                if entry.generation != generation or now - entry.created_at > self.ttl:
+                    self._remove(entry_id)
+                elif entry.vector.shape == query.shape:
+                    candidates.append(entry_id)
+
+            if candidates:
+                matrix = np.stack([self._entries[entry_id].vector for entry_id in candidates])
+                scores = matrix @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    entry_id = candidates[best]
+                    self._entries.move_to_end(entry_id)
+                    RESPONSE_CACHE_LOOKUPS.labels("hit").inc()
+                    return list(self._entries[entry_id].chunks)
+
+        RESPONSE_CACHE_LOOKUPS.labels("miss").inc()
+        return None
+
+    def store(self, user_id, vector, generation, chunks):
+        entry_id = next(self._ids)
+        with self._lock:
+            self._entries[entry_id] = _Entry(user_id, _normalize(vector), generation, tuple(chunks))
+            self._by_user.setdefault(user_id, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, user_id, generation=None):
+        with self._lock:
+            for entry_id in list(self._by_user.get(user_id, ())):
+                self._remove(entry_id)
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        user_entries = self._by_user[entry.user_id]
+        user_entries.discard(entry_id)
+        if not user_entries:
+            del self._by_user[entry.user_id]
+
+
+response_cache = SemanticResponseCache(
+    enabled=RESPONSE_CACHE_ENABLED,
+    threshold=RESPONSE_CACHE_THRESHOLD,
+    ttl=RESPONSE_CACHE_TTL,
+    max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+)
+
+# 记忆写入后旧答案立即失效
+on_memory_change(response_cache.invalidate)
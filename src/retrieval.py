@@ -0,0 +1,73 @@
+import time
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from .config import RETRIEVAL_WORKERS, RETRIEVAL_FALLBACK_USERS
+from .profiling import current_profiler
+
+# 检索调用在独立线程池中执行，请求线程只等待到截止时间；
+# 超时的调用无法中断，会在后台跑完并释放线程
+_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+
+
+def _run_profiled(fn, args, kwargs):
+    # 被采样的请求把检索线程加入采样，任务结束后移出，线程随后会服务其他请求
+    profiler = current_profiler()
+    if profiler is None:
+        return fn(*args, **kwargs)
+    profiler.add_thread()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        profiler.remove_thread()
+
+
+def call_with_deadline(deadline, fn, *args, **kwargs):
+    """
+    Run fn in the retrieval pool and wait for it until deadline (time.monotonic())
+
+    A deadline of None waits indefinitely.
+
+    Raises:
+        TimeoutError: If the deadline has passed or passes before fn returns
+    """
+    if deadline is None:
+        return fn(*args, **kwargs)
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError("Retrieval budget exhausted")
+    context = contextvars.copy_context()  # 沿用请求的日志上下文和采样器
+    future = _executor.submit(context.run, _run_profiled, fn, args, kwargs)
+    try:
+        return future.result(timeout=remaining)
+    except FutureTimeoutError:
+        future.cancel()
+        raise TimeoutError("Retrieval budget exhausted") from None
+
+
+class LastMemories:
+    """Remembers the last successfully retrieved memory text per user, as a fallback"""
+
+    def __init__(self, max_users):
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._memories = OrderedDict()
+
+    def get(self, user_id):
+        with self._lock:
+            return self._memories.get(user_id)
+
+    def put(self, user_id, memories_str):
+        with self._lock:
+            self._memories[user_id] = memories_str
+            self._memories.move_to_end(user_id)
+            while len(self._memories) > self.max_users:
+                self._memories.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._memories.pop(user_id, None)
+
+
+last_memories = LastMemories(RETRIEVAL_FALLBACK_USERS)
@@ -0,0 +1,69 @@
+from qdrant_client.http import models
+from .config import SEARCH_PARAMS, SEARCH_MAX_LIMIT
+
+# 参数名 -> (类型, 最小值, 最大值)；None 表示使用 Qdrant 默认值
+_SCHEMA = {
+    "limit": (int, 1, SEARCH_MAX_LIMIT),
+    "top_k": (int, 1, SEARCH_MAX_LIMIT),
+    "hnsw_ef": (int, 1, 4096),
+    "exact": (bool, None, None),
+    "rescore": (bool, None, None),
+    "oversampling": (float, 1.0, 16.0),
+    "alpha": (float, 0.0, 1.0),
+}
+
+
+def resolve_search_params(route, overrides=None):
+    """
+    Merge a route's configured search parameters with per-request overrides
+
+    Args:
+        route: Key of SEARCH_PARAMS ("chat", "chat_cli", "episodic")
+        overrides: Optional dict from the request's "search" field
+
+    Returns:
+        dict: Parameters with every known key present (None where unset)
+
+    Raises:
+        ValueError: If an override has an unknown key or an invalid value
+    """
+    params = dict.fromkeys(_SCHEMA)
+    params.update(SEARCH_PARAMS.get(route, {}))
+    if overrides is not None and not isinstance(overrides, dict):
+        raise ValueError("search must be an object")
+    for key, value in (overrides or {}).items():
+        if key not in _SCHEMA:
+            raise ValueError(f"Unknown search parameter: {key}")
+        params[key] = _validate(key, value)
+    return params
+
+
+def _validate(key, value):
+    if value is None:
+        return None
+    kind, low, high = _SCHEMA[key]
+    if kind is bool:
+        if not isinstance(value, bool):
+            raise ValueError(f"Search parameter {key} must be true or false")
+        return value
+    # bool 是 int 的子类，需要单独排除
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"Invalid value for search parameter {key}: {value!r}")
+    if kind is int and value != int(value):
+        raise ValueError(f"Search parameter {key} must be an integer")
+    value = kind(value)
+    if not low <= value <= high:
+        raise ValueError(f"Search parameter {key} must be between {low} and {high}")
+    return value
+
+
+def qdrant_search_params(params):
+    """Build Qdrant SearchParams from resolved parameters, or None to use collection defaults"""
+    quantization = None
+    if params.get("rescore") is not None or params.get("oversampling") is not None:
+        quantization = models.QuantizationSearchParams(rescore=params.get("rescore"),
+                                                       oversampling=params.get("oversampling"))
+    if params.get("hnsw_ef") is None and not params.get("exact") and quantization is None:
+        return None
+    return models.SearchParams(hnsw_ef=params.get("hnsw_ef"), exact=bool(params.get("exact")),
+                               quantization=quantization)
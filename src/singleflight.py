@@ -0,0 +1,69 @@
+import threading
+from functools import wraps
+from .metrics import SINGLEFLIGHT_CALLS, SINGLEFLIGHT_INFLIGHT
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one backend call.
+
+    The first caller (leader) runs the function; callers arriving while it is in
+    flight wait for it and receive the same result or exception. Nothing is cached
+    once the call completes.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        SINGLEFLIGHT_INFLIGHT.labels(name).set_function(lambda: len(self._calls))
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            SINGLEFLIGHT_CALLS.labels(self.name, "shared").inc()
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        SINGLEFLIGHT_CALLS.labels(self.name, "leader").inc()
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+
+def singleflight(name):
+    """Decorator: coalesce concurrent calls with equal arguments"""
+    group = SingleFlight(name)
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            # 参数可能包含 list 等不可哈希对象，使用 repr 作为键
+            key = repr((args, sorted(kwargs.items())))
+            return group.do(key, func, *args, **kwargs)
+        wrapper.group = group
+        return wrapper
+    return decorator
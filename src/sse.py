@@ -0,0 +1,203 @@
+import contextvars
+import json
+import logging
+import threading
+import time
+from collections import deque
+from uuid import uuid4
+from flask import Response, stream_with_context, g
+from .admission import take_request_ticket
+from .config import (SSE_REPLAY_EVENTS, SSE_RETENTION, SSE_MAX_STREAMS, SSE_HEARTBEAT_INTERVAL,
+                     SSE_COALESCE_CHARS, SSE_COALESCE_DELAY)
+from .metrics import SSE_RESUMES
+
+logger = logging.getLogger(__name__)
+
+SSE_HEADERS = {"Cache-Control": "no-cache",
+               "X-Accel-Buffering": "no",
+               "Access-Control-Allow-Origin": "*"}
+
+
+class EventStream:
+    """
+    Replay buffer for one SSE stream.
+
+    The producer appends events with increasing sequence numbers; any number of
+    readers can follow the stream from a given sequence number.
+    """
+
+    def __init__(self, stream_id, max_events=SSE_REPLAY_EVENTS):
+        self.id = stream_id
+        self.events = deque(maxlen=max_events)  # (seq, event dict)
+        self.next_seq = 0
+        self.finished_at = None
+        self.cond = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.finished_at is not None
+
+    def publish(self, event):
+        with self.cond:
+            self.events.append((self.next_seq, event))
+            self.next_seq += 1
+            self.cond.notify_all()
+
+    def finish(self):
+        with self.cond:
+            self.finished_at = time.monotonic()
+            self.cond.notify_all()
+
+    def _expired(self, after_seq):
+        # 请求的位置已被挤出回放缓冲，无法无损续传
+        return bool(self.events) and after_seq + 1 < self.events[0][0]
+
+    def _pending(self, after_seq):
+        if not self.events or after_seq + 1 >= self.next_seq:
+            return []
+        start = max(after_seq + 1 - self.events[0][0], 0)
+        return [self.events[i] for i in range(start, len(self.events))]
+
+    def read(self, after_seq=-1, heartbeat=SSE_HEARTBEAT_INTERVAL):
+        """Yield SSE frames for events after after_seq, with heartbeats while idle"""
+        while True:
+            # 持锁期间只取数据，不做任何写出
+            with self.cond:
+                # 连接中的读者落后过多时同样会丢事件，每轮都要检查
+                expired = self._expired(after_seq)
+                pending = [] if expired else self._pending(after_seq)
+                if not expired and not pending and not self.finished:
+                    self.cond.wait(heartbeat)
+                    pending = self._pending(after_seq)
+                # 只有一小段文本时稍等片刻，把相邻的小块合并成一次写出
+                deadline = time.monotonic() + SSE_COALESCE_DELAY
+                while pending and not self.finished and _only_small_content(pending):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                    pending = self._pending(after_seq)
+                finished = self.finished
+                expired = expired or self._expired(after_seq)
+
+            if expired:
+                yield _frame(None, {"error": "Stream resume window expired"})
+                yield _frame(None, {"done": True})
+                return
+            if not pending and not finished:
+                yield ": heartbeat\n\n"
+                continue
+            for seq, event in _coalesce(pending):
+                yield _frame(f"{self.id}:{seq}", event)
+                after_seq = seq
+            if finished and after_seq + 1 >= self.next_seq:
+                return
+
+
+def _only_small_content(pending):
+    if any(set(event) != {"content"} for _, event in pending):
+        return False
+    return sum(len(event["content"]) for _, event in pending) < SSE_COALESCE_CHARS
+
+
+def _coalesce(pending):
+    """Merge consecutive content events; the merged event keeps the last sequence number"""
+    merged = []
+    for seq, event in pending:
+        if merged and set(event) == {"content"} and set(merged[-1][1]) == {"content"}:
+            merged[-1] = (seq, {"content": merged[-1][1]["content"] + event["content"]})
+        else:
+            merged.append((seq, event))
+    return merged
+
+
+def _frame(event_id, event):
+    prefix = f"id: {event_id}\n" if event_id else ""
+    return f"{prefix}data: {json.dumps(event)}\n\n"
+
+
+_streams = {}
+_streams_lock = threading.Lock()
+
+
+def _sweep():
+    """Drop finished streams past their retention and keep the registry bounded"""
+    now = time.monotonic()
+    expired = [sid for sid, s in _streams.items() if s.finished and now - s.finished_at > SSE_RETENTION]
+    for sid in expired:
+        del _streams[sid]
+    if len(_streams) >= SSE_MAX_STREAMS:
+        finished = sorted((s.finished_at, sid) for sid, s in _streams.items() if s.finished)
+        for _, sid in finished[:len(_streams) - SSE_MAX_STREAMS + 1]:
+            del _streams[sid]
+
+
+def get_stream(stream_id):
+    with _streams_lock:
+        return _streams.get(stream_id)
+
+
+def parse_last_event_id(value):
+    """Split a Last-Event-ID of the form '<stream_id>:<seq>'; returns (None, -1) if malformed"""
+    if not value or ":" not in value:
+        return None, -1
+    stream_id, _, seq = value.rpartition(":")
+    try:
+        return stream_id, int(seq)
+    except ValueError:
+        return None, -1
+
+
+def _run_producer(stream, events, ticket):
+    try:
+        for event in events:
+            stream.publish(event)
+    except Exception as e:
+        logger.exception("Stream producer failed: %s", e)
+        stream.publish({"error": str(e)})
+        stream.publish({"done": True})
+    finally:
+        stream.finish()
+        if ticket is not None:
+            ticket.release()
+
+
+def stream_response(events):
+    """
+    Run an event generator in the background and stream it to the client as SSE.
+
+    The generation keeps running if the client disconnects, so a reconnect with
+    Last-Event-ID can pick up the rest from the replay buffer.
+    """
+    stream = EventStream(uuid4().hex)
+    with _streams_lock:
+        _sweep()
+        _streams[stream.id] = stream
+
+    # 生成在后台线程完成：准入名额跟随生成过程释放，并沿用当前请求的日志上下文
+    ticket = take_request_ticket()
+    context = contextvars.copy_context()
+    producer = threading.Thread(
+        target=context.run, args=(_run_producer, stream, events, ticket),
+        name=f"sse-{stream.id[:8]}", daemon=True
+    )
+    producer.start()
+    profiler = g.get('profiler')
+    if profiler is not None:
+        profiler.add_thread(producer.ident)
+
+    return Response(stream_with_context(stream.read()),
+                    mimetype="text/event-stream",
+                    headers={**SSE_HEADERS, "X-Stream-Id": stream.id})
+
+
+def resume_response(last_event_id):
+    """Resume a stream after the event named by Last-Event-ID, or None if it is unknown"""
+    stream_id, seq = parse_last_event_id(last_event_id)
+    stream = get_stream(stream_id) if stream_id else None
+    if stream is None:
+        return None
+    SSE_RESUMES.inc()
+    return Response(stream_with_context(stream.read(after_seq=seq)),
+                    mimetype="text/event-stream",
+                    headers={**SSE_HEADERS, "X-Stream-Id": stream.id})
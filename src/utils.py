@@ -1,5 +1,10 @@
 from playwright.sync_api import sync_playwright
+from .metrics import timed_call
+from .singleflight import singleflight
 
+# 同一分享链接的并发请求只启动一次浏览器
+@singleflight("chatgpt_share")
+@timed_call("playwright", "extract_chatgpt_share")
 def extract_chatgpt_share_from_link(url):
     with sync_playwright() as p:
         browser = p.chromium.launch(headless=True)
@@ -0,0 +1,113 @@
+import time
+import logging
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from .config import (openai_client, llm, qdrant_client, get_user_memory, get_collection_name,
+                     WARMUP_HOT_USERS, WARMUP_EMBED_MODELS, WARMUP_WORKERS,
+                     OLLAMA_URL, OLLAMA_KEEP_ALIVE)
+from .metrics import track_call, WARMUP_SECONDS
+
+logger = logging.getLogger(__name__)
+
+_state = {"status": "pending", "steps": {}, "started_at": None, "finished_at": None}
+_state_lock = threading.Lock()
+
+
+def _load_embedding_model(model):
+    # 发一次嵌入请求让 Ollama 加载模型，并按 keep_alive 常驻内存
+    with track_call("ollama", "embeddings"):
+        response = requests.post(
+            f"{OLLAMA_URL}/api/embeddings",
+            json={"model": model, "prompt": "warm-up", "keep_alive": OLLAMA_KEEP_ALIVE},
+            timeout=300
+        )
+    response.raise_for_status()
+
+
+def _connect_openai():
+    # 建立 TLS 连接并放入各客户端的连接池
+    with track_call("openai", "models_list"):
+        openai_client.models.list()
+    root_client = getattr(llm, "root_client", None)
+    if root_client is not None and root_client is not openai_client:
+        with track_call("openai", "models_list"):
+            root_client.models.list()
+
+
+def _connect_qdrant():
+    with track_call("qdrant", "get_collections"):
+        qdrant_client.get_collections()
+
+
+def _preload_user(user_id):
+    get_user_memory(user_id)
+    collection_name = get_collection_name(user_id)
+    # 读一个点，让 Qdrant 把集合数据载入页缓存
+    with track_call("qdrant", "scroll"):
+        qdrant_client.scroll(collection_name=collection_name, limit=1, with_payload=False, with_vectors=False)
+
+
+def _run_step(name, fn, *args):
+    started = time.perf_counter()
+    try:
+        fn(*args)
+        result = "ok"
+    except Exception as e:
+        # 预热失败不阻止服务就绪，首个请求会再走一次冷启动路径
+        logger.warning("Warm-up step %s failed: %s", name, e)
+        result = f"failed: {e}"
+    elapsed = time.perf_counter() - started
+    WARMUP_SECONDS.labels(name).set(elapsed)
+    with _state_lock:
+        _state["steps"][name] = {"result": result, "seconds": round(elapsed, 3)}
+
+
+def run_warmup(hot_users=None):
+    """
+    Warm up external dependencies before the server reports ready
+
+    Loads the Ollama embedding models and keeps them resident, opens pooled OpenAI
+    and Qdrant connections, and builds Memory instances for hot users. Steps run in
+    parallel; a failed step is logged and does not block readiness.
+    """
+    hot_users = WARMUP_HOT_USERS if hot_users is None else hot_users
+    with _state_lock:
+        _state.update(status="running", started_at=time.time())
+
+    steps = [(f"ollama:{model}", _load_embedding_model, model) for model in WARMUP_EMBED_MODELS]
+    steps += [("openai", _connect_openai), ("qdrant", _connect_qdrant)]
+    steps += [(f"user:{user_id}", _preload_user, user_id) for user_id in hot_users]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, WARMUP_WORKERS)) as executor:
+        for step in steps:
+            executor.submit(_run_step, *step)
+
+    with _state_lock:
+        _state.update(status="ready", finished_at=time.time())
+    logger.info("Warm-up finished in %.2fs", time.perf_counter() - started)
+
+
+def start_warmup(hot_users=None):
+    """Run warm-up in a background thread; readiness turns true when it finishes"""
+    thread = threading.Thread(target=run_warmup, args=(hot_users,), name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def mark_ready():
+    """Report ready without warming up (warm-up disabled)"""
+    with _state_lock:
+        _state.update(status="ready", finished_at=time.time())
+
+
+def is_ready():
+    with _state_lock:
+        return _state["status"] == "ready"
+
+
+def get_warmup_state():
+    with _state_lock:
+        return {**_state, "steps": dict(_state["steps"])}
+